@@ -0,0 +1,64 @@
+import os
+import argparse
+import logging
+from datetime import datetime
+
+from services.report_storage import ReportArchive, ReportStorage
+
+logging.basicConfig(
+    filename='archive_reports.log',
+    filemode='a',
+    format='%(asctime)s - %(levelname)s - ARCHIVE %(message)s',
+    level=logging.INFO
+)
+
+
+def archive_reports(args):
+    archive = ReportArchive(ReportStorage(root=args.reports_dir))
+
+    for day, count in archive.archive(keep_days=args.keep_days):
+        msg = f'{day:%d/%m/%Y}: {count} relatórios arquivados em {archive.bundle_path(day)}'
+        print(msg)
+        logging.info(msg)
+
+
+def get_report(args):
+    archive = ReportArchive(ReportStorage(root=args.reports_dir))
+    day = datetime.strptime(args.day, '%Y-%m-%d').date()
+    report = archive.read(args.get, day, args.run)
+
+    if report is None:
+        raise Exception(f'Nenhum relatório arquivado do telefone {args.get} em {day:%d/%m/%Y}')
+
+    name, content = report
+    pdf_file = os.path.join(args.output, name)
+    with open(pdf_file, 'wb') as file:
+        file.write(content)
+
+    print(f'Relatório extraído: {pdf_file}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Arquiva os relatórios de dias anteriores em pacotes compactados, ou extrai um relatório arquivado.')
+    parser.add_argument('--reports_dir', default='reports', help='Pasta dos relatórios')
+    parser.add_argument('--keep_days', type=int, default=7, help='Dias mais recentes que continuam fora dos pacotes')
+    parser.add_argument('--get', help='Telefone do relatório a extrair, em vez de arquivar')
+    parser.add_argument('--day', help='Com --get, dia do relatório no formato YYYY-MM-DD')
+    parser.add_argument('--run', help='Com --get, execução do relatório (padrão: a última do dia)')
+    parser.add_argument('--output', default='.', help='Com --get, pasta onde o relatório é gravado')
+    args = parser.parse_args()
+
+    try:
+        if args.get:
+            if not args.day:
+                parser.error('--get requer --day')
+            get_report(args)
+        else:
+            archive_reports(args)
+    except Exception as e:
+        logging.error(e)
+        print(e)
+
+
+if __name__ == '__main__':
+    main()
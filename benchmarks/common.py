@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+from datetime import datetime
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies):
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'avg': round(sum(latencies) / len(latencies), 6) if latencies else 0.0,
+        'p50': round(percentile(latencies, 0.50), 6),
+        'p90': round(percentile(latencies, 0.90), 6),
+        'p99': round(percentile(latencies, 0.99), 6),
+        'max': round(latencies[-1], 6) if latencies else 0.0,
+    }
+
+
+def peak_rss_kib(pid=None):
+    """
+    Peak resident set size, in KiB, of this process or, on Linux,
+    of the process pid (VmHWM), which must still be running.
+    """
+    if pid is None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in KiB on Linux.
+        return peak // 1024 if sys.platform == 'darwin' else peak
+
+    try:
+        with open(f'/proc/{pid}/status', 'r') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_result(benchmark, params, operations, elapsed, latencies, **extra):
+    """Result of one benchmark run, in the JSON format shared by the suite."""
+    result = {
+        'benchmark': benchmark,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'params': params,
+        'operations': operations,
+        'elapsed': round(elapsed, 6),
+        'throughput': round(operations / elapsed, 3) if elapsed else 0.0,
+        'latency': summarize_latencies(latencies),
+        'peak_rss_kib': peak_rss_kib(),
+    }
+    result.update(extra)
+    return result
+
+
+def emit(result, output=None):
+    """Print the result and append it, as a JSON line, to output."""
+    line = json.dumps(result, ensure_ascii=False)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+    if output:
+        with open(output, 'a') as file:
+            file.write(line + '\n')
+
+
+class Timer:
+    """Collect the latency of each timed operation."""
+
+    def __init__(self):
+        self.latencies = []
+        self.started_at = None
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def time(self, function, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
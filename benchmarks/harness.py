@@ -0,0 +1,211 @@
+import os
+import sys
+import random
+import signal
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import Timer, emit, make_result
+from benchmarks.load_generator import wait_for_port
+from benchmarks.make_bruto import make_bruto
+
+
+def make_data_file(path, clients, duplicates=0.1, seed=0):
+    """data_received.txt with `clients` phone numbers, some of them registered twice."""
+    rng = random.Random(seed)
+    phone_numbers = [f'0{i:010d}' for i in range(clients)]
+
+    with open(path, 'w') as file:
+        for i, phone_number in enumerate(phone_numbers):
+            file.write(f'cliente_{i},c{i}@mail.com,{phone_number},{rng.randint(18, 90)}\n')
+        for phone_number in rng.sample(phone_numbers, int(clients * duplicates)):
+            file.write(f'cliente_novo,novo@mail.com,{phone_number},{rng.randint(18, 90)}\n')
+
+    return phone_numbers
+
+
+def bench_client_lookup(args):
+    # Imported here, after moving to the work directory, since it opens its log on import.
+    from generate_report import get_client_data
+
+    rng = random.Random(args.seed)
+    phone_numbers = make_data_file('data_received.txt', args.clients, seed=args.seed)
+
+    build = Timer()
+    with build:
+        get_client_data(phone_numbers[:1])
+
+    timer = Timer()
+    with timer:
+        for _ in range(args.lookups):
+            timer.time(get_client_data, rng.sample(phone_numbers, args.batch))
+
+    return make_result(
+        'client_lookup',
+        {'clients': args.clients, 'lookups': args.lookups, 'batch': args.batch, 'seed': args.seed},
+        args.lookups,
+        timer.elapsed,
+        timer.latencies,
+        index_build_seconds=round(build.elapsed, 6),
+    )
+
+
+def bench_report(args):
+    from fpdf import FPDF
+    from services.raw_data import RawWeatherData
+    from services.report import CompactFPDF, RenderContext, ReportHeader, ReportPDF, ReportTemplate
+
+    make_bruto('bruto.txt', args.items, args.min_words, args.max_words, args.seed)
+    section_list = RawWeatherData('bruto.txt').section_list()
+    os.makedirs('reports', exist_ok=True)
+    context = RenderContext()
+    template = ReportTemplate(section_list, context, args.compact) if args.template else None
+    sizes = []
+
+    def generate(i):
+        client = {'name': f'Cliente {i}', 'email': f'c{i}@mail.com', 'phone_number': f'0{i:010d}', 'age': '30'}
+
+        if template is not None:
+            return template.render(client, args.in_memory)
+
+        pdf = CompactFPDF() if args.compact else FPDF()
+        report_pdf = ReportPDF(client, pdf, ReportHeader(pdf, context), context)
+        return report_pdf.generate_report_pdf(section_list, args.in_memory)
+
+    timer = Timer()
+    with timer:
+        for i in range(args.reports):
+            report = timer.time(generate, i)
+            sizes.append(len(report) if args.in_memory else os.path.getsize(report))
+
+    return make_result(
+        'report',
+        {
+            'reports': args.reports,
+            'items': args.items,
+            'min_words': args.min_words,
+            'max_words': args.max_words,
+            'template': args.template,
+            'in_memory': args.in_memory,
+            'compact': args.compact,
+            'seed': args.seed,
+        },
+        args.reports,
+        timer.elapsed,
+        timer.latencies,
+        avg_report_bytes=round(sum(sizes) / len(sizes)) if sizes else 0,
+    )
+
+
+def bench_email(args):
+    from services.email import EmailService, SMTPSender
+
+    with open('relatorio.pdf', 'wb') as file:
+        file.write(random.Random(args.seed).randbytes(args.attachment_kib * 1024))
+
+    sink = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.smtp_sink', '--port', str(args.smtp_port)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+
+    try:
+        wait_for_port('localhost', args.smtp_port)
+        sender = SMTPSender('localhost', args.smtp_port, '', '', pool_size=args.pool_size, use_tls=False)
+        email_service = EmailService(sender, 'benchmark@localhost')
+
+        def send(i):
+            results = email_service.send_email(
+                body='Segue em anexo o relatório meteorológico.',
+                subject='Relatório Meteorológico',
+                recipient=f'cliente{i}@localhost',
+                attachment_path='relatorio.pdf',
+            )
+            if any(error is not None for error in results.values()):
+                raise RuntimeError(results)
+
+        timer = Timer()
+        with timer:
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(lambda i: timer.time(send, i), range(args.emails)))
+
+        sender.close()
+    finally:
+        sink.send_signal(signal.SIGINT)
+        sink.wait(timeout=10)
+
+    return make_result(
+        'email',
+        {
+            'emails': args.emails,
+            'attachment_kib': args.attachment_kib,
+            'pool_size': args.pool_size,
+            'concurrency': args.concurrency,
+            'seed': args.seed,
+        },
+        args.emails,
+        timer.elapsed,
+        timer.latencies,
+    )
+
+
+HARNESSES = {
+    'client_lookup': bench_client_lookup,
+    'report': bench_report,
+    'email': bench_email,
+}
+
+
+def run_all(args):
+    """Run every harness in its own process, so each one has its own peak RSS."""
+    command = [sys.executable, '-m', 'benchmarks.harness']
+    extra = ['--seed', str(args.seed)] + (['--output', os.path.abspath(args.output)] if args.output else [])
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    for name in HARNESSES:
+        subprocess.run(command + [name] + extra, cwd=root, check=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks da consulta de clientes, da geração de relatórios e do envio de e-mails.')
+    parser.add_argument('harness', choices=[*HARNESSES, 'all'], help='Benchmark executado')
+    parser.add_argument('--seed', type=int, default=0, help='Semente dos dados sintéticos')
+    parser.add_argument('--output', help='Arquivo JSON lines onde o resultado é acrescentado')
+    parser.add_argument('--clients', type=int, default=100000, help='client_lookup: clientes no data_received.txt')
+    parser.add_argument('--lookups', type=int, default=200, help='client_lookup: número de consultas')
+    parser.add_argument('--batch', type=int, default=10, help='client_lookup: telefones por consulta')
+    parser.add_argument('--reports', type=int, default=50, help='report: relatórios gerados')
+    parser.add_argument('--items', type=int, default=50, help='report: itens por seção do arquivo bruto')
+    parser.add_argument('--min_words', type=int, default=10, help='report: menor número de palavras por mensagem')
+    parser.add_argument('--max_words', type=int, default=80, help='report: maior número de palavras por mensagem')
+    parser.add_argument('--template', action='store_true', help='report: usa o ReportTemplate')
+    parser.add_argument('--compact', action='store_true', help='report: gera os PDFs compactos')
+    parser.add_argument('--in_memory', action='store_true', help='report: gera os PDFs em memória')
+    parser.add_argument('--emails', type=int, default=100, help='email: e-mails enviados')
+    parser.add_argument('--attachment_kib', type=int, default=256, help='email: tamanho do anexo em KiB')
+    parser.add_argument('--pool_size', type=int, default=4, help='email: sessões SMTP do pool')
+    parser.add_argument('--concurrency', type=int, default=4, help='email: envios simultâneos')
+    parser.add_argument('--smtp_port', type=int, default=2525, help='email: porta do servidor SMTP local')
+    args = parser.parse_args()
+
+    if args.harness == 'all':
+        run_all(args)
+        return
+
+    output = os.path.abspath(args.output) if args.output else None
+
+    # The synthetic files, the reports and the logs stay in a temporary directory.
+    with tempfile.TemporaryDirectory(prefix='nimbus-bench-') as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            result = HARNESSES[args.harness](args)
+        finally:
+            os.chdir(cwd)
+
+    emit(result, output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import os
+import sys
+import time
+import shlex
+import random
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import Counter, deque
+
+from benchmarks.common import emit, make_result, peak_rss_kib
+
+
+# Same values as server.py, which isn't imported so its log isn't opened here.
+HOST = 'localhost'
+PORT = 5784
+MAX_RECORD_SIZE = 64 * 1024
+RECORD_KINDS = ('valid', 'invalid', 'oversized')
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server.py')
+
+
+def parse_mix(mix):
+    """Parse `valid=0.9,invalid=0.1` into the weight of each record kind."""
+    weights = dict.fromkeys(RECORD_KINDS, 0.0)
+
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in weights:
+            raise argparse.ArgumentTypeError(f'Tipo de registro desconhecido: {kind}')
+        weights[kind] = float(weight)
+
+    return weights
+
+
+def make_record(rng, kind, connection, i):
+    phone_number = f'0{connection % 100:02d}{i % 100000000:08d}'
+
+    if kind == 'valid':
+        return f'cliente_{connection}_{i},c{i}@mail.com,{phone_number},{rng.randint(18, 90)}\n'.encode('utf-8')
+    if kind == 'invalid':
+        return rng.choice((
+            f'cliente_{i},email-invalido,{phone_number},30\n',
+            f'cliente_{i},c{i}@mail.com,123,30\n',
+            f'cliente_{i},c{i}@mail.com\n',
+        )).encode('utf-8')
+    return b'x' * (MAX_RECORD_SIZE + 1) + b'\n'
+
+
+def make_records(rng, weights, connection, count):
+    kinds = rng.choices(list(weights), weights=list(weights.values()), k=count)
+    return [make_record(rng, kind, connection, i) for i, kind in enumerate(kinds)]
+
+
+async def run_connection(host, port, records, pipeline, latencies, replies):
+    """
+    Send the records through one connection with at most `pipeline`
+    records waiting for their replies, timing each reply.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    in_flight = asyncio.Semaphore(pipeline)
+    sent_at = deque()
+
+    async def send():
+        for record in records:
+            await in_flight.acquire()
+            sent_at.append(time.perf_counter())
+            writer.write(record)
+            await writer.drain()
+
+    sender = asyncio.create_task(send())
+
+    try:
+        for _ in records:
+            reply = await reader.readline()
+            if not reply:
+                replies['(conexão encerrada)'] += 1
+                break
+            latencies.append(time.perf_counter() - sent_at.popleft())
+            replies[reply.decode('utf-8').strip()] += 1
+            in_flight.release()
+    finally:
+        sender.cancel()
+        writer.close()
+
+
+async def run_load(host, port, connections, records_per_connection, pipeline, weights, seed):
+    rng = random.Random(seed)
+    workload = [make_records(rng, weights, connection, records_per_connection) for connection in range(connections)]
+    latencies = []
+    replies = Counter()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        run_connection(host, port, records, pipeline, latencies, replies)
+        for records in workload
+    ))
+    return time.perf_counter() - start, latencies, replies
+
+
+def wait_for_port(host, port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+
+    raise TimeoutError(f'O servidor não abriu a porta {port} em {timeout}s')
+
+
+def start_server(port, server_args, workdir):
+    """Run server.py in workdir, so the benchmark doesn't touch the real data file."""
+    command = [sys.executable, SERVER_SCRIPT, '--port', str(port), *shlex.split(server_args)]
+    process = subprocess.Popen(command, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port('localhost', port)
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gerador de carga TCP para o servidor de recepção de dados.')
+    parser.add_argument('--host', default=HOST, help='Endereço do servidor')
+    parser.add_argument('--port', type=int, default=PORT, help='Porta do servidor')
+    parser.add_argument('--connections', type=int, default=10, help='Conexões simultâneas')
+    parser.add_argument('--records', type=int, default=1000, help='Registros enviados por conexão')
+    parser.add_argument('--pipeline', type=int, default=1, help='Registros aguardando resposta por conexão (1 = requisição/resposta)')
+    parser.add_argument('--mix', type=parse_mix, default='valid=1', help='Proporção de cada tipo de registro, ex.: valid=0.9,invalid=0.08,oversized=0.02')
+    parser.add_argument('--seed', type=int, default=0, help='Semente da carga gerada')
+    parser.add_argument('--spawn', action='store_true', help='Inicia o server.py em uma pasta temporária durante o benchmark')
+    parser.add_argument('--server_args', default='--log_sample 0', help='Argumentos extras do server.py iniciado com --spawn')
+    parser.add_argument('--output', help='Arquivo JSON lines onde o resultado é acrescentado')
+    args = parser.parse_args()
+
+    server = None
+    workdir = None
+
+    if args.spawn:
+        workdir = tempfile.TemporaryDirectory(prefix='nimbus-bench-')
+        server = start_server(args.port, args.server_args, workdir.name)
+
+    try:
+        elapsed, latencies, replies = asyncio.run(run_load(
+            args.host, args.port, args.connections, args.records, args.pipeline, args.mix, args.seed
+        ))
+        server_peak_rss = peak_rss_kib(server.pid) if server is not None else None
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGINT)
+            server.wait(timeout=30)
+            workdir.cleanup()
+
+    emit(make_result(
+        'ingestion',
+        {
+            'connections': args.connections,
+            'records_per_connection': args.records,
+            'pipeline': args.pipeline,
+            'mix': args.mix,
+            'seed': args.seed,
+            'server_args': args.server_args if args.spawn else None,
+        },
+        len(latencies),
+        elapsed,
+        latencies,
+        replies=dict(replies),
+        server_peak_rss_kib=server_peak_rss,
+    ), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+import json
+import random
+import argparse
+from datetime import datetime, timedelta
+
+from services.raw_data import SECTIONS, SECTION_FIELD
+
+
+PHENOMENA = ('chuva', 'deslizamento', 'alagamento', 'vendaval', 'granizo', 'onda de calor')
+WORDS = (
+    'chuva', 'forte', 'moderada', 'ao', 'longo', 'do', 'dia', 'com', 'períodos', 'de',
+    'intensificação', 'em', 'algumas', 'áreas', 'trovoadas', 'risco', 'alagamentos',
+    'temporários', 'rajadas', 'vento', 'previsão', 'indica', 'temperatura', 'elevada',
+    'umidade', 'relativa', 'baixa', 'atenção', 'encostas', 'região', 'metropolitana',
+)
+
+
+def make_message(rng, min_words, max_words):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    return ' '.join(words).capitalize() + '.'
+
+
+def make_items(rng, count, start, min_words, max_words, phenomenon_ratio=0.5):
+    items = []
+
+    for _ in range(count):
+        item = {}
+        if rng.random() < phenomenon_ratio:
+            item['fenomeno'] = rng.choice(PHENOMENA)
+        item['data'] = (start + timedelta(hours=rng.randint(0, 72))).strftime('%Y-%m-%dT%H:%M')
+        item['mensagem'] = make_message(rng, min_words, max_words)
+        items.append(item)
+
+    return items
+
+
+def make_bruto(path, items=100, min_words=10, max_words=80, seed=0, json_lines=False):
+    """Write the synthetic file to path, with `items` items per section."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    data = {key: make_items(rng, items, start, min_words, max_words) for key in SECTIONS}
+
+    with open(path, 'w') as file:
+        if json_lines:
+            for key, section_items in data.items():
+                for item in section_items:
+                    file.write(json.dumps({SECTION_FIELD: key, **item}, ensure_ascii=False) + '\n')
+        else:
+            json.dump(data, file, ensure_ascii=False, indent=4)
+
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera um arquivo bruto sintético para os benchmarks.')
+    parser.add_argument('--items', type=int, default=100, help='Itens por seção')
+    parser.add_argument('--min_words', type=int, default=10, help='Menor número de palavras por mensagem')
+    parser.add_argument('--max_words', type=int, default=80, help='Maior número de palavras por mensagem')
+    parser.add_argument('--seed', type=int, default=0, help='Semente, para gerar sempre o mesmo arquivo')
+    parser.add_argument('--jsonl', action='store_true', help='Gera a variante JSON lines')
+    parser.add_argument('--output', default='bench_bruto.txt', help='Arquivo gerado')
+    args = parser.parse_args()
+
+    make_bruto(args.output, args.items, args.min_words, args.max_words, args.seed, args.jsonl)
+    print(args.output)
+
+
+if __name__ == '__main__':
+    main()
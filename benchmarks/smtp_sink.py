@@ -0,0 +1,64 @@
+import asyncio
+import argparse
+
+
+class SMTPSink:
+    """
+    Minimal SMTP server that accepts and discards every message,
+    so send_email can be timed without a real mail server.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    async def handle(self, reader, writer):
+        writer.write(b'220 nimbus-sink ESMTP\r\n')
+
+        try:
+            while line := await reader.readline():
+                command = line[:4].upper()
+
+                if command in (b'EHLO', b'HELO'):
+                    writer.write(b'250-nimbus-sink\r\n250-8BITMIME\r\n250 SIZE 104857600\r\n')
+                elif command == b'DATA':
+                    writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                    await writer.drain()
+                    data = await reader.readuntil(b'\r\n.\r\n')
+                    self.messages += 1
+                    self.bytes += len(data)
+                    writer.write(b'250 OK\r\n')
+                elif command == b'QUIT':
+                    writer.write(b'221 Bye\r\n')
+                    break
+                else:
+                    writer.write(b'250 OK\r\n')
+
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(host, port):
+    sink = SMTPSink()
+    server = await asyncio.start_server(sink.handle, host=host, port=port, limit=128 * 1024 * 1024)
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor SMTP local que descarta as mensagens, para os benchmarks.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=2525)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,18 @@
 import os
 import re
-import json
 import logging
 import argparse
 from datetime import datetime
 
-from fpdf import FPDF
-
-from services.email import email_service
-from services.report import ReportHeader, ReportPDF
+from services.client_store import ClientStore
+from services.logs import LOG_MODES, SAMPLED, configure_logging, stop_logging, use_direct_logging
+from services.metrics import metrics
+from services.raw_data import RawWeatherData
+from services.report_output import TEMPLATE_VERSION, ReportBuffer
+from services.report_storage import ReportStorage
+from services.report_cache import ReportManifest
+from services.segments import merge_segments
+from services.time_index import window_sections
 
 logging.basicConfig(
     filename='generate_report.log', 
@@ -18,27 +22,29 @@ logging.basicConfig(
 )
 
 
-def get_client_data(phone_numbers):
+def get_client_data(phone_numbers, db_path='clients.db', data_path='data_received.txt', client_store=None):
     """
-    Retrieves the clients data from the .txt file that 
-    was populated by the TCP/IP server. 
-    Transform it into a dictionary and return it.
+    Retrieves the clients data from the phone number index of 
+    the .txt file that was populated by the TCP/IP server. 
+    Lines added since the last run, including the segments of a
+    multi-process server not merged yet, are indexed first. An open
+    client_store is used as is and left open.
     """
     logging.info('Recuperando dados do cliente...')
-    clients = []
-
-    with open('data_received.txt', 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-            name, email, phone_number, age = line.strip().split(',')
-            if phone_number in phone_numbers:
-                clients.append({
-                    'name': name,
-                    'email': email,
-                    'phone_number': phone_number,
-                    'age': age
-                })
-    return clients
+
+    if client_store is not None:
+        merge_segments(client_store.data_path, client_store)
+        client_store.sync()
+        return client_store.get_clients(phone_numbers)
+
+    client_store = ClientStore(db_path=db_path, data_path=data_path)
+
+    try:
+        merge_segments(data_path, client_store)
+        client_store.sync()
+        return client_store.get_clients(phone_numbers)
+    finally:
+        client_store.close()
 
 
 def validate_date(date_str):
@@ -71,69 +77,329 @@ def create_reports_dir():
         os.mkdir('reports')
 
 
-def main():
-    create_reports_dir()
-    try:
-        parser = argparse.ArgumentParser(description='Gera relatórios meteorológicos com base em parâmetros de entrada.')
-        parser.add_argument('--phone', help='Telefones dos clientes separados por vírgula')
-        parser.add_argument('--date', help='Data do relatório no formato YYYY-MM-DDTHH:MM')
-        parser.add_argument('--file', help='Caminho para o arquivo .txt com dados de meteorologia', default='file.txt')
-        parser.add_argument('--send_email', action='store_true', help='Flag para enviar o relatório por e-mail')
+def generate_client_report(client, section_list, in_memory=False, context=None, compact=False):
+    # fpdf is only imported by the runs that render a report.
+    from fpdf import FPDF
+    from services.report import CompactFPDF, ReportHeader, ReportPDF
 
-        logging.info('Coletando os dados passados pelo comando...')
-        args = parser.parse_args()
-        
-        is_valid, msg = validate_date(args.date)
-        
-        if not is_valid:
-            raise Exception(msg)
+    logging.info('Criado PDF para geração do relatório...', extra=SAMPLED)
+    pdf = CompactFPDF() if compact else FPDF()
+    report_header = ReportHeader(pdf, context)
+    report_pdf = ReportPDF(client, pdf, report_header)
+    logging.info('Gerando relatório...', extra=SAMPLED)
+    return report_pdf.generate_report_pdf(section_list, in_memory)
+
+
+def make_report_builder(section_list, template=False, in_memory=False, compact=False, storage=None):
+    """
+    Return the function that generates the report of a client.
+    In template mode the shared sections are laid out only once
+    and each client only gets its header stamped. In memory
+    mode the report is returned as a ReportBuffer, and in compact
+    mode it's written with CompactFPDF. The reports are named
+    and placed by storage.
+    """
+    from services.report import RenderContext, ReportTemplate
+
+    context = RenderContext(storage)
+
+    if not template:
+        return lambda client: generate_client_report(client, section_list, in_memory, context, compact)
+
+    logging.info('Gerando modelo do relatório...')
+    report_template = ReportTemplate(section_list, context, compact)
+    return lambda client: report_template.render(client, in_memory)
+
+
+def generate_reports(clients, section_list, template=False, in_memory=False, compact=False, storage=None):
+    """
+    Generate the reports one after another, yielding
+    (client, pdf_file, error) in the clients order.
+    """
+    if not clients:
+        return
+
+    build_report = make_report_builder(section_list, template, in_memory, compact, storage)
+
+    for client in clients:
+        try:
+            with metrics.time('report.render'):
+                pdf_file = build_report(client)
+            yield client, pdf_file, None
+        except Exception as e:
+            yield client, None, e
+
+
+def merge_cached_reports(clients, cached_reports, results):
+    """
+    Yield (client, pdf_file, error) in the clients order, taking the
+    reports that are still current from cached_reports and the
+    others, in the same order, from results.
+    """
+    results = iter(results)
+
+    for client in clients:
+        cached = cached_reports.get(client['phone_number'])
+
+        if cached is not None:
+            yield client, cached, None
+        else:
+            yield next(results)
+
+
+_worker_section_list = None
+_worker_template = False
+_worker_in_memory = False
+_worker_compact = False
+_worker_storage = None
+_worker_build_report = None
+
+
+def _init_report_worker(section_list, template, in_memory, compact, storage):
+    """Keep the parsed weather data in the worker, so tasks only carry the client."""
+    global _worker_section_list, _worker_template, _worker_in_memory, _worker_compact, _worker_storage
+    _worker_section_list = section_list
+    _worker_template = template
+    _worker_in_memory = in_memory
+    _worker_compact = compact
+    _worker_storage = storage
+    # Drop the metrics a forked worker inherits from the parent process,
+    # and log directly, since the logging thread isn't inherited.
+    metrics.collect()
+    use_direct_logging()
+
+
+def _generate_worker_report(client):
+    global _worker_build_report
+
+    # Built on the first task, so a failure is reported for the clients.
+    if _worker_build_report is None:
+        _worker_build_report = make_report_builder(
+            _worker_section_list, _worker_template, _worker_in_memory, _worker_compact, _worker_storage
+        )
+
+    with metrics.time('report.render'):
+        pdf_file = _worker_build_report(client)
+
+    # The metrics recorded in the worker are merged by the parent process.
+    return pdf_file, metrics.collect()
+
+
+def generate_reports_parallel(clients, section_list, workers, template=False, in_memory=False, compact=False, storage=None):
+    """
+    Spread the reports across a pool of worker processes,
+    yielding (client, pdf_file, error) in the clients order.
+    A failing client doesn't affect the others.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if not clients:
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_report_worker,
+        initargs=(section_list, template, in_memory, compact, storage)
+    ) as executor:
+        futures = [executor.submit(_generate_worker_report, client) for client in clients]
+
+        for client, future in zip(clients, futures):
+            try:
+                pdf_file, worker_metrics = future.result()
+                metrics.merge(worker_metrics)
+                yield client, pdf_file, None
+            except Exception as e:
+                yield client, None, e
 
-        with open(args.file, 'r') as file:
-            file_data = json.load(file)
-            logging.info('Acessando o arquivo bruto.txt...')
 
-        analysis = file_data.get('análise', [])
-        predictions = file_data.get('previsao', [])
+def build_parser():
+    parser = argparse.ArgumentParser(description='Gera relatórios meteorológicos com base em parâmetros de entrada.')
+    parser.add_argument('--phone', help='Telefones dos clientes separados por vírgula')
+    parser.add_argument('--date', help='Data do relatório no formato YYYY-MM-DDTHH:MM')
+    parser.add_argument('--file', help='Caminho para o arquivo .txt com dados de meteorologia', default='file.txt')
+    parser.add_argument('--send_email', action='store_true', help='Flag para enviar o relatório por e-mail')
+    parser.add_argument('--workers', type=int, default=1, help='Número de processos usados para gerar os relatórios')
+    parser.add_argument('--stream', action='store_true', help='Lê o arquivo de dados de forma incremental, sem carregá-lo inteiro na memória')
+    parser.add_argument('--lookback', type=float, help='Horas antes de --date incluídas no relatório')
+    parser.add_argument('--lookahead', type=float, help='Horas depois de --date incluídas no relatório')
+    parser.add_argument('--output', choices=['file', 'memory'], default='file', help='Grava os relatórios na pasta reports ou os mantém em memória para o envio por e-mail')
+    parser.add_argument('--spill', action='store_true', help='No modo memory, também grava os relatórios na pasta reports')
+    parser.add_argument('--template', action='store_true', help='Monta o conteúdo comum uma única vez e apenas carimba o cabeçalho de cada cliente')
+    parser.add_argument('--compact', action='store_true', help='Gera PDFs menores, com o cabeçalho das caixas definido uma única vez e reaproveitado em todas as páginas')
+    parser.add_argument('--force', action='store_true', help='Gera novamente todos os relatórios, mesmo os que não mudaram desde a última execução')
+    parser.add_argument('--metrics', help='Arquivo JSON onde as métricas de cada etapa são gravadas ao final')
+    parser.add_argument('--profile', default='', help='Etapas executadas sob o cProfile, separadas por vírgula (ex.: report.output)')
+    parser.add_argument('--log_mode', choices=LOG_MODES, default='async', help='async grava o log em uma thread separada, sem bloquear a geração dos relatórios')
+    parser.add_argument('--log_sample', type=float, default=1.0, help='Fração (0 a 1) das mensagens por relatório gravadas no log')
+
+    return parser
+
+
+def run_reports(args, datasets=None, client_store=None, output=print, close_sessions=True, email_service=None):
+    """
+    Generate (and optionally send) the reports requested by args,
+    returning the summary lines. A resident service passes its warm
+    datasets cache, client_store and email_service, collects the
+    messages through output and keeps the SMTP sessions open between
+    runs. Otherwise the e-mail service is built from the environment.
+    """
+    is_valid, msg = validate_date(args.date)
+    
+    if not is_valid:
+        raise Exception(msg)
 
-        phone_numbers = args.phone.split(',')
-        clients = get_client_data(phone_numbers)
+    in_memory = args.output == 'memory'
+    # Every report of this run carries its run id, so concurrent runs don't collide.
+    storage = ReportStorage()
 
-        if not clients:
-            msg = f'Não existe clientes com esse(s) telefone(s): {" ".join(phone_numbers)}'
-            print(msg)
-            logging.warning(msg)
+    if not in_memory or args.spill:
+        create_reports_dir()
+
+    logging.info('Acessando o arquivo bruto.txt...')
+    with metrics.time('report.parse'):
+        if datasets is None:
+            section_list = RawWeatherData(args.file).section_list(stream=args.stream)
+        else:
+            section_list = datasets.section_list(args.file, stream=args.stream)
+
+    if args.lookback is not None or args.lookahead is not None:
+        report_date = datetime.strptime(args.date, '%Y-%m-%dT%H:%M')
+        logging.info('Filtrando os itens pela janela de datas do relatório...')
+        if datasets is None or args.stream:
+            section_list = window_sections(section_list, report_date, args.lookback, args.lookahead)
+        else:
+            section_list = datasets.window_sections(args.file, report_date, args.lookback, args.lookahead)
+
+    phone_numbers = args.phone.split(',')
+    with metrics.time('report.client_lookup'):
+        clients = get_client_data(phone_numbers, client_store=client_store)
+
+    if not clients:
+        msg = f'Não existe clientes com esse(s) telefone(s): {" ".join(phone_numbers)}'
+        output(msg)
+        logging.warning(msg)
+
+    manifest = None
+    digests = {}
+    cached_reports = {}
+    pending_clients = clients
+
+    if not in_memory:
+        logging.info('Verificando os relatórios que não mudaram desde a última execução...')
+        manifest = ReportManifest()
+        creation_date = datetime.now().strftime('%d/%m/%Y')
+        sections_digest = ReportManifest.sections_digest(
+            section_list, TEMPLATE_VERSION, args.compact, args.date, creation_date
+        )
 
         for client in clients:
-            logging.info('Criado PDF para geração do relatório...')
-            pdf = FPDF()
-            report_header = ReportHeader(pdf)
-            report_pdf = ReportPDF(client, pdf, report_header)
-            section_list = [
-                {'Análise': analysis}, 
-                {'Previsão': predictions}
-            ]
-            logging.info('Gerando relatório...')
-            pdf_file = report_pdf.generate_report_pdf(section_list)
-
-            msg = f'Relatório gerado: {pdf_file}'
-            print(msg)
+            digests[client['phone_number']] = ReportManifest.report_digest(client, sections_digest)
+
+        if not args.force:
+            for client in clients:
+                cached = manifest.get(client['phone_number'], digests[client['phone_number']])
+                if cached is not None:
+                    cached_reports[client['phone_number']] = cached
+
+            pending_clients = [client for client in clients if client['phone_number'] not in cached_reports]
+
+    if args.workers > 1:
+        results = generate_reports_parallel(pending_clients, section_list, args.workers, args.template, in_memory, args.compact, storage)
+    else:
+        results = generate_reports(pending_clients, section_list, args.template, in_memory, args.compact, storage)
+
+    if cached_reports:
+        results = merge_cached_reports(clients, cached_reports, results)
+
+    summary = []
+    email_dispatcher = None
+
+    if args.send_email:
+        from services.email import EmailDispatcher, email_service_from_env
+
+        if email_service is None:
+            email_service = email_service_from_env()
+        email_dispatcher = EmailDispatcher(email_service, concurrency=email_service.email_sender.pool_size)
+        date, hour = get_date_hour(args.date)
+        SUBJECT = f'Relatório Meteorológico {"/".join(date)} às {hour}'
+        BODY = f'Olá.\n\nSegue em anexo o relatório meteorológico do dia {"/".join(date)} às {hour}\n\nHavendo dúvidas, por favor, entre em contato.'
+
+    try:
+        for client, pdf_file, error in results:
+            if error is not None:
+                msg = f'Erro ao gerar o relatório do telefone {client["phone_number"]}: {error}'
+                output(msg)
+                logging.error(msg)
+                summary.append(f'{client["phone_number"]}: ERRO ({error})')
+                continue
+
+            report_buffer = None
+
+            if isinstance(pdf_file, ReportBuffer):
+                report_buffer = pdf_file
+                pdf_file = report_buffer.spill() if args.spill else report_buffer.filename
+
+            report = pdf_file if report_buffer is None else report_buffer
+            summary.append(f'{client["phone_number"]}: {report}')
+
+            if client['phone_number'] in cached_reports:
+                msg = f'Relatório sem alterações: {report}'
+            else:
+                msg = f'Relatório gerado: {report}'
+                if manifest is not None:
+                    manifest.update(client['phone_number'], digests[client['phone_number']], pdf_file)
+
+            output(msg)
             logging.info(msg)
 
-            if args.send_email:
-                date, hour = get_date_hour(args.date)
-                SUBJECT = f'Relatório Meteorológico {"/".join(date)} às {hour}'
-                BODY = f'Olá.\n\nSegue em anexo o relatório meteorológico do dia {"/".join(date)} às {hour}\n\nHavendo dúvidas, por favor, entre em contato.'
-                logging.info('Enviando arquivo PDF do relatório via email...')
-                email_service.send_email(
+            if email_dispatcher is not None:
+                logging.info('Enviando arquivo PDF do relatório via email...', extra=SAMPLED)
+                email_dispatcher.submit(
                     body=BODY,
                     subject=SUBJECT,
                     recipient=client['email'], 
-                    attachment_path=pdf_file
+                    attachment_path=pdf_file,
+                    attachment_content=None if report_buffer is None else report_buffer.content
                 )
-                msg = 'E-mail enviado com sucesso!'
-                logging.info(msg)
-                print(msg)
 
+        if email_dispatcher is not None:
+            for recipient, delivery in email_dispatcher.results():
+                for address, delivery_error in delivery.items():
+                    if delivery_error is None:
+                        msg = f'E-mail enviado com sucesso para {address}!'
+                        logging.info(msg)
+                    else:
+                        msg = f'Erro ao enviar e-mail para {address}: {delivery_error}'
+                        logging.error(msg)
+                    output(msg)
+    finally:
+        if manifest is not None:
+            manifest.save()
+        if email_dispatcher is not None:
+            email_dispatcher.close(close_sessions)
+
+    if len(summary) > 1:
+        output('Resumo:')
+        output('\n'.join(summary))
+        logging.info(f'Resumo: {"; ".join(summary)}')
+
+    return summary
+
+
+def main():
+    try:
+        logging.info('Coletando os dados passados pelo comando...')
+        args = build_parser().parse_args()
+        configure_logging(args.log_mode, args.log_sample)
+        metrics.profile_stages.update(stage for stage in args.profile.split(',') if stage)
+
+        try:
+            run_reports(args)
+        finally:
+            if args.metrics:
+                metrics.dump(args.metrics)
+            metrics.dump_profiles()
+            stop_logging()
     except Exception as e:
         print(e)
 
@@ -0,0 +1,293 @@
+import json
+import asyncio
+import argparse
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from generate_report import build_parser, run_reports
+from services.client_store import ClientStore
+from services.logs import LOG_MODES, configure_logging, stop_logging
+from services.metrics import metrics
+from services.raw_data import RawDataCache
+
+
+HOST = 'localhost'
+PORT = 5785
+JOB_WORKERS = 1
+MAX_REQUEST_SIZE = 64 * 1024
+MAX_FINISHED_JOBS = 1000
+# Options of generate_report.py that apply to the whole process, not to a job.
+PROCESS_OPTIONS = ('metrics', 'profile', 'log_mode', 'log_sample')
+
+
+class ReportJob:
+    def __init__(self, job_id, args):
+        self.id = job_id
+        self.args = args
+        self.status = 'queued'
+        self.messages = []
+        self.summary = []
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+
+    def to_dict(self):
+        return {
+            'job': self.id,
+            'status': self.status,
+            'phone': self.args.phone,
+            'date': self.args.date,
+            'messages': list(self.messages),
+            'summary': list(self.summary),
+            'error': self.error,
+            'created_at': self.created_at.isoformat(timespec='seconds'),
+            'started_at': self.started_at and self.started_at.isoformat(timespec='seconds'),
+            'finished_at': self.finished_at and self.finished_at.isoformat(timespec='seconds'),
+        }
+
+
+class ReportDaemon:
+    """
+    Resident report service. The parsed weather files, the client
+    index and the SMTP sessions stay warm between jobs, which run
+    on a pool of job_workers threads in the order they arrive.
+    """
+
+    def __init__(self, job_workers=JOB_WORKERS, db_path='clients.db', data_path='data_received.txt'):
+        self.db_path = db_path
+        self.data_path = data_path
+        self.datasets = RawDataCache()
+        self.executor = ThreadPoolExecutor(max_workers=job_workers)
+        self.jobs = OrderedDict()
+        self.job_ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.thread_state = threading.local()
+        self.client_stores = []
+        self.email_service = None
+
+    def _client_store(self):
+        """Client index of the current job thread, opened on its first job."""
+        client_store = getattr(self.thread_state, 'client_store', None)
+
+        if client_store is None:
+            client_store = ClientStore(db_path=self.db_path, data_path=self.data_path)
+            self.thread_state.client_store = client_store
+            with self.lock:
+                self.client_stores.append(client_store)
+
+        return client_store
+
+    def _email_service(self):
+        """E-mail service shared by every job, built on the first job that sends e-mails."""
+        from services.email import email_service_from_env
+
+        with self.lock:
+            if self.email_service is None:
+                self.email_service = email_service_from_env()
+            return self.email_service
+
+    def parse_job(self, request):
+        """
+        Build the arguments of a job from the request fields, which
+        are the options of generate_report.py without the dashes,
+        parsed and checked by its own argument parser.
+        """
+        parser = build_parser()
+        defaults = parser.parse_args([])
+        argv = []
+
+        def error(message):
+            raise ValueError(f'Opção inválida: {message}')
+
+        parser.error = error
+
+        for key, value in request.items():
+            if key in ('action', 'wait'):
+                continue
+            if not hasattr(defaults, key) or key in PROCESS_OPTIONS:
+                raise ValueError(f'Opção desconhecida: {key}')
+            if key == 'phone' and isinstance(value, list):
+                value = ','.join(str(phone) for phone in value)
+
+            if getattr(defaults, key) is False:
+                # A flag of generate_report.py, set only by JSON true.
+                if not isinstance(value, bool):
+                    raise ValueError(f'O campo {key} deve ser true ou false')
+                if value:
+                    argv.append(f'--{key}')
+            elif value is not None:
+                if isinstance(value, (bool, list, dict)):
+                    raise ValueError(f'O campo {key} deve ser um texto ou um número')
+                argv.append(f'--{key}={value}')
+
+        args = parser.parse_args(argv)
+
+        if not args.phone or not args.date:
+            raise ValueError('Os campos phone e date são obrigatórios')
+
+        return args
+
+    def submit(self, request):
+        args = self.parse_job(request)
+
+        with self.lock:
+            job = ReportJob(str(next(self.job_ids)), args)
+            self.jobs[job.id] = job
+            self._drop_finished_jobs()
+
+        job.future = self.executor.submit(self._run_job, job)
+        logging.info(f'Job {job.id} recebido: telefone(s) {args.phone}, data {args.date}')
+        return job
+
+    def _drop_finished_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _run_job(self, job):
+        job.status = 'running'
+        job.started_at = datetime.now()
+
+        try:
+            job.summary = run_reports(
+                job.args,
+                datasets=self.datasets,
+                client_store=self._client_store(),
+                output=job.messages.append,
+                close_sessions=False,
+                email_service=self._email_service() if job.args.send_email else None,
+            )
+            job.status = 'done'
+        except Exception as e:
+            logging.error(f'Erro no job {job.id}: {e}')
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = datetime.now()
+
+        logging.info(f'Job {job.id} finalizado: {job.status}')
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(str(job_id))
+
+    def list_jobs(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+        for client_store in self.client_stores:
+            client_store.close()
+        if self.email_service is not None:
+            self.email_service.email_sender.close()
+
+
+async def handle_request(request, daemon):
+    action = request.get('action', 'submit')
+
+    if action == 'submit':
+        job = daemon.submit(request)
+        if request.get('wait'):
+            await asyncio.wrap_future(job.future)
+        return job.to_dict()
+
+    if action == 'status':
+        job = daemon.get(request.get('job'))
+        if job is None:
+            return {'error': f'Job não encontrado: {request.get("job")}'}
+        return job.to_dict()
+
+    if action == 'metrics':
+        return metrics.snapshot()
+
+    if action == 'list':
+        return {'jobs': [{'job': job.id, 'status': job.status} for job in daemon.list_jobs()]}
+
+    return {'error': f'Ação desconhecida: {action}'}
+
+
+async def handle_client(reader, writer, daemon):
+    """
+    Each newline-terminated JSON request gets one
+    newline-terminated JSON reply on the same connection.
+    """
+    try:
+        while True:
+            try:
+                line = await reader.readuntil(b'\n')
+            except asyncio.IncompleteReadError as e:
+                line = e.partial
+            except asyncio.LimitOverrunError:
+                writer.write(b'{"error": "Requisi\\u00e7\\u00e3o muito longa"}\n')
+                break
+
+            if not line.strip():
+                if reader.at_eof():
+                    break
+                continue
+
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('A requisição deve ser um objeto JSON')
+                reply = await handle_request(request, daemon)
+            except ValueError as e:
+                reply = {'error': str(e)}
+
+            writer.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+            await writer.drain()
+    except ConnectionError as e:
+        logging.error(f'Erro na conexão com o cliente do serviço de relatórios: {e}')
+    finally:
+        writer.close()
+
+
+async def serve(host, port, daemon):
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_client(reader, writer, daemon),
+        host=host,
+        port=port,
+        limit=MAX_REQUEST_SIZE,
+    )
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serviço residente de geração de relatórios meteorológicos.')
+    parser.add_argument('--host', help='Endereço de escuta do serviço', default=HOST)
+    parser.add_argument('--port', help='Porta de escuta do serviço', type=int, default=PORT)
+    parser.add_argument('--job_workers', help='Número de jobs executados ao mesmo tempo', type=int, default=JOB_WORKERS)
+    parser.add_argument('--client_store', help='Caminho do índice SQLite de clientes', default='clients.db')
+    parser.add_argument('--log_mode', help='async grava o log em uma thread separada, sem bloquear os jobs', choices=LOG_MODES, default='async')
+    parser.add_argument('--log_sample', help='Fração (0 a 1) das mensagens por relatório gravadas no log', type=float, default=1.0)
+    args = parser.parse_args()
+
+    configure_logging(args.log_mode, args.log_sample)
+
+    daemon = ReportDaemon(job_workers=args.job_workers, db_path=args.client_store)
+    logging.info(f'Serviço de relatórios rodando na porta {args.port}')
+    print(f'Serviço de relatórios rodando na porta {args.port}. Aguardando jobs...')
+
+    try:
+        asyncio.run(serve(args.host, args.port, daemon))
+    except KeyboardInterrupt:
+        logging.info('Serviço de relatórios interrompido manualmente.')
+        print('\nServiço de relatórios interrompido manualmente.')
+    finally:
+        daemon.close()
+        stop_logging()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,19 @@
-import logging
+import os
+import time
+import signal
 import socket
-import re
+import asyncio
+import argparse
+import logging
+import sqlite3
 
-import pyfiglet
-from rich import print as banner
+from services.admission import AdmissionControl
+from services.client_store import ClientStore
+from services.logs import LOG_MODES, SAMPLED, configure_logging, stop_logging
+from services.metrics import MetricsDumper, metrics, serve_metrics
+from services.segments import merge_segments, segment_path, segments_dir
+from services.validation import validate_record, validate_records
+from services.writer import BatchWriter, FSYNC_POLICIES
 
 
 logging.basicConfig(
@@ -13,31 +23,34 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+HOST = 'localhost'
+PORT = 5784
+BACKLOG = 1024
+MAX_CONNECTIONS = 10000
+MAX_RECORD_SIZE = 64 * 1024
+RECORD_DELIMITER = b'\n'
+MAX_PENDING_REPLIES = 1024
+READ_SIZE = 64 * 1024
+MAX_QUEUED_RECORDS = 100000
+IDLE_TIMEOUT = 300.0
+READ_TIMEOUT = 30.0
+SHUTDOWN_TIMEOUT = 30.0
+
+
+def show_banner():
+    """Print the start-up banner. pyfiglet and rich are only imported here."""
+    import pyfiglet
+    from rich import print as rich_print
+
+    rich_print(pyfiglet.figlet_format('Nimbus\nMeteorologia', font='big', width=300))
+
 
 def validate_data(data):
     """
     Validate data which is name, email, 
     phone number, and age before saving.
     """
-    data_list = data.strip().split(',')
-
-    if len(data_list) != 4:
-        return False
-
-    name, email, phone_number, age = data_list
-    email_regex = r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$'
-    phone_number_regex = r'^(\d{11}|\d{12})$'
-
-    if not re.match(email_regex, email) or not re.match(phone_number_regex, phone_number):
-        return False
-
-    if not age.isdigit():
-        return False
-
-    if not isinstance(name, str) or name.isdigit():
-        return False
-
-    return True
+    return validate_record(data) is None
 
 
 def save_data(data):
@@ -46,40 +59,58 @@ def save_data(data):
         f.write(data)
 
 
-def tcp_ip_server():
+def tcp_ip_server(host=HOST, port=PORT, backlog=5, read_timeout=READ_TIMEOUT, banner=True):
     """
     Create a continuous data reception 
-    service that uses TCP/IP protocol
+    service that uses TCP/IP protocol.
+    A client that sends nothing for read_timeout
+    seconds is disconnected.
     """
     logging.info("Iniciando servidor TCP/IP...")
-    PORT = 5784
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server.bind(('localhost', PORT))
-    server.listen(5)
-    logging.info("Servidor rodando na porta 5784")
-    banner(pyfiglet.figlet_format('Nimbus\nMeteorologia', font='big', width=300))
-    print("Servidor TCP/IP rodando na porta 5784. Aguardando conexões...")
+    server.bind((host, port))
+    server.listen(backlog)
+    logging.info(f"Servidor rodando na porta {port}")
+    if banner:
+        show_banner()
+    print(f"Servidor TCP/IP rodando na porta {port}. Aguardando conexões...")
     logging.info("Aguardando conexões...")
 
     try:
         while True:
             client_socket, client_address = server.accept()
-            logging.info(f"Conexão recebida de {client_address}")
-            print(f"Conexão recebida de {client_address}")
+            metrics.incr('server.connections')
+            logging.info(f"Conexão recebida de {client_address}", extra=SAMPLED)
+            client_socket.settimeout(read_timeout or None)
 
-            data_received = client_socket.recv(1024).decode('utf-8')
-            logging.info("-" * 20)
-            logging.info(f"Dados recebidos: {data_received}")
+            try:
+                with metrics.time('server.recv'):
+                    data_received = client_socket.recv(1024).decode('utf-8')
+            except socket.timeout:
+                metrics.incr('server.connections.timeout')
+                logging.warning(f"Conexão com {client_address} encerrada por inatividade")
+                client_socket.close()
+                continue
+            logging.debug(f"Dados recebidos: {data_received!r}")
 
             if data_received:
-                if validate_data(data_received):
-                    save_data(data_received)
-                    logging.info("Dados válidos e salvos!")
-                    logging.info("-" * 20)
-                    client_socket.sendall("Ok".encode('utf-8'))
+                metrics.incr('server.records')
+
+                with metrics.time('server.validate'):
+                    is_valid = validate_data(data_received)
+
+                if is_valid:
+                    with metrics.time('server.save'):
+                        save_data(data_received)
+                    logging.info(f"Dados válidos e salvos ({client_address})", extra=SAMPLED)
+                    reply = "Ok"
                 else:
-                    logging.error("Dados inválidos!")
-                    client_socket.sendall("Erro: formato inválido".encode('utf-8'))
+                    metrics.incr('server.records.invalid')
+                    logging.error(f"Dados inválidos ({client_address}): {data_received!r}")
+                    reply = "Erro: formato inválido"
+
+                with metrics.time('server.reply'):
+                    client_socket.sendall(reply.encode('utf-8'))
 
             client_socket.close()
     except KeyboardInterrupt:
@@ -92,5 +123,467 @@ def tcp_ip_server():
         server.close()
 
 
+async def read_record_batches(reader, idle_timeout=None, read_timeout=None):
+    """
+    Yield the newline-delimited records sent through the
+    connection, in batches of the records already received,
+    reassembling records split across reads. A last record
+    without the delimiter is accepted at EOF and records
+    longer than MAX_RECORD_SIZE are yielded as None.
+    Raises asyncio.TimeoutError when no record starts within
+    idle_timeout seconds, or a record started isn't complete
+    within read_timeout seconds.
+    """
+    loop = asyncio.get_running_loop()
+    buffer = b''
+    discarding = False
+    record_started = None
+
+    while True:
+        if record_started is None:
+            timeout = idle_timeout
+        else:
+            timeout = read_timeout and max(0, record_started + read_timeout - loop.time())
+
+        if timeout is None:
+            chunk = await reader.read(READ_SIZE)
+        else:
+            chunk = await asyncio.wait_for(reader.read(READ_SIZE), timeout)
+
+        if not chunk:
+            if discarding:
+                yield [None]
+            elif buffer.strip():
+                yield [buffer]
+            return
+
+        records = (buffer + chunk).split(RECORD_DELIMITER)
+        buffer = records.pop()
+
+        if discarding and records:
+            # The first line is the tail of the record being discarded.
+            records[0] = None
+            discarding = False
+
+        if discarding or len(buffer) > MAX_RECORD_SIZE:
+            discarding = True
+            buffer = b''
+
+        # The read deadline runs from the first chunk of the record still incomplete.
+        if buffer or discarding:
+            if records or record_started is None:
+                record_started = loop.time()
+        else:
+            record_started = None
+
+        batch = [
+            None if record is None or len(record) > MAX_RECORD_SIZE else record
+            for record in records
+            if record is None or record.strip()
+        ]
+        if batch:
+            yield batch
+
+
+def process_records(records, batch_writer, allowed=None):
+    """
+    Validate a batch of records and hand the valid ones to the
+    batch writer. Returns, for each record, either the reply to
+    send back or the future that resolves once it is durable.
+    Only the first `allowed` records are accepted, when given,
+    and records are refused while the writer queue is full.
+    """
+    replies = [None] * len(records)
+    received = []
+
+    if allowed is not None and allowed < len(records):
+        metrics.incr('server.records.throttled', len(records) - allowed)
+        logging.warning(f"Limite de envio excedido: {len(records) - allowed} registros recusados", extra=SAMPLED)
+        replies[allowed:] = ["Erro: limite de envio excedido"] * (len(records) - allowed)
+    else:
+        allowed = len(records)
+
+    for i, record in enumerate(records[:allowed]):
+        if record is None:
+            metrics.incr('server.records.oversized')
+            logging.error("Registro excede o tamanho máximo")
+            replies[i] = "Erro: registro muito longo"
+            continue
+
+        try:
+            received.append((i, record.decode('utf-8').strip()))
+        except UnicodeDecodeError:
+            metrics.incr('server.records.invalid')
+            logging.error(f"Dados inválidos: {record!r}")
+            replies[i] = "Erro: formato inválido"
+
+    metrics.incr('server.records', len(records))
+    metrics.incr('server.recv.bytes', sum(len(record) + 1 for record in records if record is not None))
+
+    with metrics.time('server.validate'):
+        reasons = validate_records([data_received for _, data_received in received])
+
+    busy = 0
+
+    for (i, data_received), reason in zip(received, reasons):
+        logging.debug(f"Dados recebidos: {data_received!r}")
+
+        if reason is None:
+            try:
+                replies[i] = batch_writer.submit(f"{data_received}\n")
+            except asyncio.QueueFull:
+                busy += 1
+                replies[i] = "Erro: servidor ocupado"
+        else:
+            metrics.incr('server.records.invalid')
+            logging.error(f"Dados inválidos ({reason}): {data_received!r}")
+            replies[i] = "Erro: formato inválido"
+
+    if busy:
+        metrics.incr('server.records.busy', busy)
+        logging.warning(f"Fila de gravação cheia: {busy} registros recusados", extra=SAMPLED)
+
+    return replies
+
+
+async def send_replies(writer, pending, write_timeout=None):
+    """
+    Send the replies of a connection in the order its
+    records arrived, waiting for each save to be durable.
+    A client that doesn't read its replies for write_timeout
+    seconds is disconnected.
+    """
+    connected = True
+
+    while (reply := await pending.get()) is not None:
+        if isinstance(reply, asyncio.Future):
+            try:
+                await reply
+                logging.info("Dados válidos e salvos", extra=SAMPLED)
+                reply = "Ok"
+            except OSError as e:
+                logging.error(f"Erro ao salvar os dados: {e}")
+                reply = "Erro: falha ao salvar"
+
+        if not connected:
+            continue
+
+        start = time.perf_counter()
+        writer.write(f"{reply}\n".encode('utf-8'))
+        if pending.empty():
+            try:
+                await asyncio.wait_for(writer.drain(), write_timeout)
+            except ConnectionError:
+                connected = False
+            except asyncio.TimeoutError:
+                metrics.incr('server.connections.timeout')
+                logging.warning("Conexão encerrada: o cliente não lê as respostas")
+                writer.transport.abort()
+                connected = False
+        metrics.observe('server.reply', time.perf_counter() - start)
+
+
+async def handle_client(reader, writer, connection_limit, batch_writer, admission):
+    """
+    Serve a persistent connection of the asyncio server. Each
+    newline-delimited record gets its own newline-terminated
+    reply, so clients can pipeline many records per connection.
+    The per-IP limits and the deadlines come from admission, and
+    beyond max_connections new connections are answered as busy.
+    """
+    start = time.perf_counter()
+    client_address = writer.get_extra_info('peername')
+    ip = client_address[0] if client_address else None
+
+    if connection_limit.locked():
+        metrics.incr('server.connections.busy')
+        logging.warning(f"Conexão recusada de {client_address}: servidor ocupado", extra=SAMPLED)
+        writer.write("Erro: servidor ocupado\n".encode('utf-8'))
+        writer.close()
+        return
+
+    if not admission.connect(ip):
+        metrics.incr('server.connections.rejected')
+        logging.warning(f"Conexão recusada de {client_address}: limite de conexões por IP", extra=SAMPLED)
+        writer.write("Erro: muitas conexões\n".encode('utf-8'))
+        writer.close()
+        return
+
+    try:
+        async with connection_limit:
+            metrics.observe('server.accept', time.perf_counter() - start)
+            metrics.incr('server.connections')
+            logging.info(f"Conexão recebida de {client_address}", extra=SAMPLED)
+            pending = asyncio.Queue(maxsize=MAX_PENDING_REPLIES)
+            replier = asyncio.create_task(send_replies(writer, pending, admission.idle_timeout))
+
+            try:
+                async for records in read_record_batches(reader, admission.idle_timeout, admission.read_timeout):
+                    allowed = admission.allow(ip, len(records))
+                    for reply in process_records(records, batch_writer, allowed):
+                        await pending.put(reply)
+            except asyncio.TimeoutError:
+                metrics.incr('server.connections.timeout')
+                logging.warning(f"Conexão com {client_address} encerrada por inatividade")
+            except ConnectionError as e:
+                logging.error(f"Erro na conexão com {client_address}: {e}")
+            finally:
+                await pending.put(None)
+                await replier
+                writer.close()
+    finally:
+        admission.disconnect(ip)
+
+
+async def serve(host, port, max_connections, backlog, batch_writer, metrics_port=None, reuse_port=False, admission=None):
+    """
+    Accept connections concurrently, serving at most
+    max_connections clients at the same time. The metrics
+    are served as JSON on metrics_port, when given. SIGTERM
+    stops the server after the queued records are written.
+    """
+    connection_limit = asyncio.Semaphore(max_connections)
+    stopping = asyncio.Event()
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+    except NotImplementedError:
+        pass
+
+    if admission is None:
+        admission = AdmissionControl(idle_timeout=IDLE_TIMEOUT, read_timeout=READ_TIMEOUT)
+    await batch_writer.start()
+
+    if metrics_port:
+        await serve_metrics(metrics, host=host, port=metrics_port)
+        logging.info(f"Métricas disponíveis em http://{host}:{metrics_port}/")
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_client(reader, writer, connection_limit, batch_writer, admission),
+        host=host,
+        port=port,
+        backlog=backlog,
+        limit=MAX_RECORD_SIZE,
+        reuse_port=reuse_port or None,
+    )
+    try:
+        await stopping.wait()
+    finally:
+        server.close()
+        await batch_writer.close()
+
+
+def async_tcp_ip_server(host=HOST, port=PORT, max_connections=MAX_CONNECTIONS, backlog=BACKLOG, batch_writer=None, metrics_port=None, reuse_port=False, announce=True, admission=None, banner=True):
+    """
+    Asyncio version of the data reception service, able
+    to serve thousands of concurrent connections.
+    """
+    logging.info("Iniciando servidor TCP/IP assíncrono...")
+    logging.info(f"Servidor rodando na porta {port}")
+    if announce:
+        if banner:
+            show_banner()
+        print(f"Servidor TCP/IP rodando na porta {port}. Aguardando conexões...")
+    logging.info(f"Aguardando conexões (limite: {max_connections}, backlog: {backlog})...")
+
+    if batch_writer is None:
+        batch_writer = BatchWriter(max_queue_size=MAX_QUEUED_RECORDS)
+
+    try:
+        asyncio.run(serve(host, port, max_connections, backlog, batch_writer, metrics_port, reuse_port, admission))
+    except KeyboardInterrupt:
+        logging.info("Servidor interrompido manualmente.")
+        if announce:
+            print("\nServidor interrompido manualmente.")
+    except Exception as e:
+        logging.critical(f"Ocorreu o seguinte erro no servidor: {e}")
+    finally:
+        logging.info("Servidor interrompido.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serviço contínuo de recepção de dados via TCP/IP.')
+    parser.add_argument('--host', help='Endereço de escuta do servidor', default=HOST)
+    parser.add_argument('--port', help='Porta de escuta do servidor', type=int, default=PORT)
+    parser.add_argument('--mode', help='Modo de execução do servidor', choices=['async', 'blocking'], default='async')
+    parser.add_argument('--max_connections', help='Número máximo de conexões simultâneas', type=int, default=MAX_CONNECTIONS)
+    parser.add_argument('--backlog', help='Tamanho da fila de conexões pendentes', type=int, default=BACKLOG)
+    parser.add_argument('--commit_interval', help='Intervalo, em segundos, para agrupar registros em um único commit', type=float, default=0.002)
+    parser.add_argument('--max_batch_size', help='Número máximo de registros por commit', type=int, default=4096)
+    parser.add_argument('--fsync', help='Política de fsync aplicada a cada commit', choices=FSYNC_POLICIES, default='always')
+    parser.add_argument('--max_queue', help='Número máximo de registros aguardando gravação; acima dele o servidor responde "Erro: servidor ocupado" (0 = sem limite)', type=int, default=MAX_QUEUED_RECORDS)
+    parser.add_argument('--idle_timeout', help='Segundos sem receber registros até a conexão ser encerrada (0 = sem limite)', type=float, default=IDLE_TIMEOUT)
+    parser.add_argument('--read_timeout', help='Segundos para terminar de receber um registro já iniciado (0 = sem limite)', type=float, default=READ_TIMEOUT)
+    parser.add_argument('--max_connections_per_ip', help='Número máximo de conexões simultâneas de um mesmo IP (0 = sem limite)', type=int, default=0)
+    parser.add_argument('--rate_limit', help='Registros por segundo aceitos de um mesmo IP (0 = sem limite)', type=float, default=0.0)
+    parser.add_argument('--rate_burst', help='Registros que um IP pode enviar de uma vez acima de --rate_limit (padrão: um segundo de --rate_limit)', type=int, default=0)
+    parser.add_argument('--client_store', help='Caminho do índice SQLite de clientes', default='clients.db')
+    parser.add_argument('--metrics_port', help='Porta do endpoint local de métricas (modo async)', type=int)
+    parser.add_argument('--metrics_file', help='Arquivo JSON onde as métricas são gravadas periodicamente')
+    parser.add_argument('--metrics_interval', help='Intervalo, em segundos, entre as gravações de --metrics_file', type=float, default=10.0)
+    parser.add_argument('--profile', help='Etapas executadas sob o cProfile, separadas por vírgula (ex.: server.validate)', default='')
+    parser.add_argument('--log_mode', help='async grava o log em uma thread separada, sem bloquear as conexões', choices=LOG_MODES, default='async')
+    parser.add_argument('--log_sample', help='Fração (0 a 1) das mensagens por conexão/registro gravadas no log', type=float, default=1.0)
+    parser.add_argument('--no_banner', help='Não exibe o banner ao iniciar', dest='banner', action='store_false')
+    parser.add_argument('--processes', help='Número de processos do servidor, que dividem a porta via SO_REUSEPORT (modo async)', type=int, default=1)
+    parser.add_argument('--merge_interval', help='Intervalo, em segundos, para juntar os segmentos dos processos ao arquivo de dados', type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.processes > 1:
+        if args.mode == 'blocking':
+            parser.error('--processes só é suportado no modo async')
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            parser.error('SO_REUSEPORT não é suportado neste sistema')
+        run_workers(args)
+    else:
+        run_server(args)
+
+
+def run_server(args, worker=None):
+    """
+    Run the server configured by the command line arguments. A
+    worker of the multi-process mode shares the port through
+    SO_REUSEPORT and writes to its own segment of the data file,
+    with its metrics on metrics_port + worker and metrics_file.<worker>.
+    """
+    configure_logging(args.log_mode, args.log_sample)
+
+    metrics.profile_stages.update(stage for stage in args.profile.split(',') if stage)
+    metrics_dumper = None
+    metrics_file = args.metrics_file
+    metrics_port = args.metrics_port
+    profile_dir = 'profiles'
+
+    if worker is not None:
+        # Ctrl+C reaches the whole process group, but the workers
+        # are stopped by the parent process, with SIGTERM.
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        metrics_file = metrics_file and f'{metrics_file}.{worker}'
+        metrics_port = metrics_port and metrics_port + worker
+        profile_dir = os.path.join(profile_dir, str(worker))
+
+    if metrics_file:
+        metrics_dumper = MetricsDumper(metrics, metrics_file, args.metrics_interval)
+        metrics_dumper.start()
+
+    try:
+        if args.mode == 'blocking':
+            tcp_ip_server(host=args.host, port=args.port, backlog=args.backlog, read_timeout=args.read_timeout, banner=args.banner)
+        else:
+            if worker is None:
+                batch_writer = BatchWriter(
+                    commit_interval=args.commit_interval,
+                    max_batch_size=args.max_batch_size,
+                    fsync=args.fsync,
+                    client_store=ClientStore(db_path=args.client_store),
+                    max_queue_size=args.max_queue,
+                )
+            else:
+                # The parent process indexes the segments as it merges them.
+                batch_writer = BatchWriter(
+                    filepath=segment_path(worker),
+                    commit_interval=args.commit_interval,
+                    max_batch_size=args.max_batch_size,
+                    fsync=args.fsync,
+                    max_queue_size=args.max_queue,
+                    stamp=True,
+                )
+
+            # In the multi-process mode the per-IP limits apply to each process.
+            admission = AdmissionControl(
+                max_connections_per_ip=args.max_connections_per_ip,
+                rate_limit=args.rate_limit,
+                rate_burst=args.rate_burst,
+                idle_timeout=args.idle_timeout,
+                read_timeout=args.read_timeout,
+            )
+
+            async_tcp_ip_server(
+                host=args.host,
+                port=args.port,
+                max_connections=args.max_connections,
+                backlog=args.backlog,
+                batch_writer=batch_writer,
+                metrics_port=metrics_port,
+                reuse_port=worker is not None,
+                announce=worker is None,
+                admission=admission,
+                banner=args.banner,
+            )
+    finally:
+        if metrics_dumper is not None:
+            metrics_dumper.close()
+        metrics.dump_profiles(profile_dir)
+        stop_logging()
+
+
+def run_workers(args):
+    """
+    Start args.processes asyncio servers on the same port, each one
+    in its own process, and merge the segments they write into the
+    data file (and the client index) every args.merge_interval seconds.
+    SIGINT and SIGTERM stop the workers with SIGTERM, so each one
+    writes its queued records before the last merge.
+    """
+    import threading
+    import multiprocessing
+
+    client_store = ClientStore(db_path=args.client_store)
+    merge_segments(client_store=client_store, remove=True)
+    os.makedirs(segments_dir(), exist_ok=True)
+
+    stopping = threading.Event()
+    received = []
+
+    def stop(signum, frame):
+        received.append(signum)
+        stopping.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    workers = [
+        multiprocessing.Process(target=run_server, args=(args, worker), name=f'server-{worker}')
+        for worker in range(args.processes)
+    ]
+    for process in workers:
+        process.start()
+
+    configure_logging(args.log_mode, args.log_sample)
+    logging.info(f"Servidor rodando na porta {args.port} com {args.processes} processos")
+    if args.banner:
+        show_banner()
+    print(f"Servidor TCP/IP rodando na porta {args.port} com {args.processes} processos. Aguardando conexões...")
+
+    try:
+        while not stopping.is_set() and any(process.is_alive() for process in workers):
+            stopping.wait(args.merge_interval)
+            try:
+                merge_segments(client_store=client_store)
+            except (OSError, sqlite3.Error) as e:
+                logging.error(f"Erro ao juntar os segmentos ao arquivo de dados: {e}")
+    finally:
+        if signal.SIGINT in received:
+            logging.info("Servidor interrompido manualmente.")
+            print("\nServidor interrompido manualmente.")
+        elif received:
+            logging.info("Servidor encerrado por SIGTERM.")
+
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        for process in workers:
+            process.join(timeout=SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                logging.error(f"Processo {process.name} não encerrou em {SHUTDOWN_TIMEOUT:g}s e foi finalizado à força")
+                process.kill()
+                process.join()
+
+        merge_segments(client_store=client_store, remove=True)
+        client_store.close()
+        logging.info("Servidor interrompido.")
+        stop_logging()
+
+
 if __name__ == "__main__":
-    tcp_ip_server()
+    main()
@@ -0,0 +1,55 @@
+import time
+from collections import OrderedDict
+
+
+class AdmissionControl:
+    """
+    Limits applied to the peers of the asyncio server: the number
+    of simultaneous connections and the rate of records of each IP
+    (a token bucket of rate_limit records per second, holding up to
+    rate_burst records), plus the deadlines of each connection.
+    Zero disables a limit or a deadline.
+    """
+    MAX_TRACKED_PEERS = 100000
+
+    def __init__(self, max_connections_per_ip=0, rate_limit=0.0, rate_burst=0, idle_timeout=0.0, read_timeout=0.0) -> None:
+        self.max_connections_per_ip = max_connections_per_ip
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst or max(1, int(rate_limit))
+        self.idle_timeout = idle_timeout or None
+        self.read_timeout = read_timeout or None
+        self.connections = {}
+        # IP -> (tokens, updated_at), kept after the peer disconnects so
+        # reconnecting doesn't refill the bucket. The oldest are dropped.
+        self.buckets = OrderedDict()
+
+    def connect(self, ip) -> bool:
+        """Register a new connection of ip, unless it already has too many."""
+        count = self.connections.get(ip, 0)
+
+        if self.max_connections_per_ip and count >= self.max_connections_per_ip:
+            return False
+
+        self.connections[ip] = count + 1
+        return True
+
+    def disconnect(self, ip):
+        count = self.connections.pop(ip, 0) - 1
+        if count > 0:
+            self.connections[ip] = count
+
+    def allow(self, ip, records) -> int:
+        """How many of the records just received from ip are within its rate."""
+        if not self.rate_limit:
+            return records
+
+        now = time.monotonic()
+        tokens, updated_at = self.buckets.pop(ip, (self.rate_burst, now))
+        tokens = min(self.rate_burst, tokens + (now - updated_at) * self.rate_limit)
+        allowed = min(records, int(tokens))
+
+        self.buckets[ip] = (tokens - allowed, now)
+        if len(self.buckets) > self.MAX_TRACKED_PEERS:
+            self.buckets.popitem(last=False)
+
+        return allowed
@@ -0,0 +1,139 @@
+import os
+import sqlite3
+import logging
+
+
+CLIENT_FIELDS = ('name', 'email', 'phone_number', 'age')
+
+
+def parse_client_line(line):
+    """
+    Transform a `name,email,phone,age` line into a dictionary.
+    Returns None for lines that don't have exactly four fields.
+    """
+    fields = line.strip().split(',')
+
+    if len(fields) != len(CLIENT_FIELDS):
+        return None
+
+    return dict(zip(CLIENT_FIELDS, fields))
+
+
+class ClientStore:
+    """
+    SQLite index of the clients registered in the data file,
+    keyed by phone number. The index remembers the offset of
+    the data file it has already read, so it is kept up to date
+    incrementally. Duplicate registrations resolve to the latest
+    line of the data file.
+    """
+
+    def __init__(self, db_path='clients.db', data_path='data_received.txt'):
+        self.db_path = db_path
+        self.data_path = data_path
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS clients ('
+            'phone_number TEXT PRIMARY KEY, name TEXT, email TEXT, age TEXT, seq INTEGER)'
+        )
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)')
+
+    def close(self):
+        self.conn.close()
+
+    def _get_offset(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'offset'").fetchone()
+        return row[0] if row else 0
+
+    def _upsert_lines(self, lines, offset):
+        """Index the given raw lines, which start at `offset` in the data file."""
+        rows = []
+
+        for line in lines:
+            client = parse_client_line(line.decode('utf-8', errors='replace'))
+
+            if client is None:
+                logging.warning(f'Linha ignorada no índice de clientes (offset {offset}): {line!r}')
+            else:
+                rows.append((client['phone_number'], client['name'], client['email'], client['age'], offset))
+
+            offset += len(line)
+
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO clients (phone_number, name, email, age, seq) VALUES (?, ?, ?, ?, ?)',
+            rows
+        )
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('offset', ?)", (offset,))
+
+    def append(self, lines, start_offset):
+        """
+        Index lines that were just appended to the data file at
+        `start_offset`. Falls back to a full catch-up when the
+        index is not exactly at that position.
+        """
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            if self._get_offset() == start_offset:
+                self._upsert_lines(lines, start_offset)
+            else:
+                self._sync(self._get_offset())
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def sync(self):
+        """Index every complete line added to the data file since the last sync."""
+        if not os.path.isfile(self.data_path):
+            return
+
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._sync(self._get_offset())
+            self.conn.execute('COMMIT')
+        except BaseException:
+            self.conn.execute('ROLLBACK')
+            raise
+
+    def _sync(self, offset, batch_size=10000):
+        if os.path.getsize(self.data_path) < offset:
+            logging.warning('Arquivo de dados truncado, reconstruindo o índice de clientes...')
+            self.conn.execute('DELETE FROM clients')
+            offset = 0
+
+        with open(self.data_path, 'rb') as f:
+            f.seek(offset)
+            lines = []
+
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+
+                lines.append(line)
+                if len(lines) == batch_size:
+                    self._upsert_lines(lines, offset)
+                    offset += sum(len(line) for line in lines)
+                    lines = []
+
+            self._upsert_lines(lines, offset)
+
+    def get_clients(self, phone_numbers, chunk_size=500):
+        """
+        Fetch the clients with the given phone numbers, in
+        the order they were requested.
+        """
+        phone_numbers = list(dict.fromkeys(phone_numbers))
+        found = {}
+
+        for i in range(0, len(phone_numbers), chunk_size):
+            chunk = phone_numbers[i:i + chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f'SELECT name, email, phone_number, age FROM clients WHERE phone_number IN ({placeholders})',
+                chunk
+            )
+            for row in rows:
+                found[row[2]] = dict(zip(CLIENT_FIELDS, row))
+
+        return [found[phone] for phone in phone_numbers if phone in found]
@@ -1,11 +1,30 @@
+import io
 import os
+import re
+import mmap
+import time
+import uuid
+import queue
+import base64
+import logging
 import smtplib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email import policy
+from email.generator import BytesGenerator
+from email.header import Header
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
-from email import encoders
 from datetime import datetime
 
+from services.metrics import metrics
+
+
+SMTP_PORT = 587
+SMTP_POOL_SIZE = 4
+
 
 def get_date() -> str:
     return datetime.now().strftime('%d/%m/%Y')
@@ -22,44 +41,315 @@ class EmailMessageBuilder:
     def create_message(self):
         self.msg['From'] = self.sender
         self.msg['To'] = self.recipient
-        self.msg['Subject'] = self.subject
+        self.msg['Subject'] = Header(self.subject, 'utf-8')
         self.msg.attach(MIMEText(self.body, 'plain'))
         return self.msg
 
 
+class EncodedAttachment:
+    """
+    Base64 payload of a file, encoded only once from a memory map
+    and shared by every message that attaches the same file. The
+    messages carry a placeholder that SMTPSender replaces by the
+    payload while streaming it to the socket.
+    """
+    BLOCK_SIZE = 57 * 1024
+
+    def __init__(self, filename, data):
+        self.filename = filename
+        self.placeholder = f'nimbus-attachment-{uuid.uuid4().hex}'.encode('ascii')
+        self.payload = self._encode(data) if len(data) else b''
+
+    @classmethod
+    def from_file(cls, filepath):
+        with open(filepath, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return cls(os.path.basename(filepath), b'')
+
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return cls(os.path.basename(filepath), data)
+
+    def _encode(self, data):
+        encoded = bytearray()
+
+        for i in range(0, len(data), self.BLOCK_SIZE):
+            encoded += base64.encodebytes(data[i:i + self.BLOCK_SIZE]).replace(b'\n', b'\r\n')
+
+        # The line break after the payload is written by the MIME generator.
+        del encoded[-2:]
+        return encoded
+
+    def __len__(self):
+        return len(self.payload)
+
+    def iter_chunks(self, chunk_size=64 * 1024):
+        payload = memoryview(self.payload)
+
+        for i in range(0, len(payload), chunk_size):
+            yield payload[i:i + chunk_size]
+
+
+class AttachmentCache:
+    """
+    Encoded attachments by file, reused while the file is
+    unchanged. The oldest entries are dropped once the
+    payloads exceed max_bytes.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, filepath):
+        stat = os.stat(filepath)
+        key = (os.path.realpath(filepath), stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        attachment = EncodedAttachment.from_file(filepath)
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = attachment
+                self.size += len(attachment)
+
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, dropped = self.entries.popitem(last=False)
+                self.size -= len(dropped)
+
+            return self.entries[key]
+
+
+attachment_cache = AttachmentCache()
+
+
 class EmailAttachment:
-    def __init__(self, filepath):
+    """
+    Attaches a file, or a content already in memory when
+    `content` is given, with `filepath` as its file name.
+    """
+
+    def __init__(self, filepath, content=None):
         self.filepath = filepath
+        self.content = content
+
+    def _get_encoded(self):
+        if self.content is not None:
+            return EncodedAttachment(os.path.basename(self.filepath), self.content)
 
-    def attach(self, msg):
         if self.filepath and os.path.isfile(self.filepath):
-            part = MIMEBase('application', 'octet-stream')
+            return attachment_cache.get(self.filepath)
+
+        return None
 
-            with open(self.filepath, 'rb') as file:
-                part.set_payload(file.read())
+    def attach(self, msg):
+        encoded = self._get_encoded()
 
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f'attachment; filename= {os.path.basename(self.filepath)}')
+        if encoded is not None:
+            part = MIMEBase('application', 'octet-stream')
+            part.set_payload(encoded.placeholder.decode('ascii'))
+            part['Content-Transfer-Encoding'] = 'base64'
+            part.add_header('Content-Disposition', f'attachment; filename= {encoded.filename}')
             msg.attach(part)
 
+            if not hasattr(msg, 'encoded_attachments'):
+                msg.encoded_attachments = []
+            msg.encoded_attachments.append(encoded)
+
+
+def message_chunks(msg):
+    """
+    Serialize the message for the DATA command as a list of
+    chunks, with the shared attachment payloads in place of
+    their placeholders instead of a full copy of the message.
+    """
+    buffer = io.BytesIO()
+    BytesGenerator(buffer, policy=policy.compat32.clone(linesep='\r\n')).flatten(msg)
+    pending = [buffer.getvalue()]
+    chunks = []
+
+    for encoded in getattr(msg, 'encoded_attachments', []):
+        before, after = pending.pop().split(encoded.placeholder, 1)
+        chunks.append(quote_periods(before))
+        chunks.extend(encoded.iter_chunks())
+        pending.append(after)
+
+    last = quote_periods(pending.pop())
+    if not last.endswith(b'\r\n'):
+        last += b'\r\n'
+    chunks.append(last)
+
+    return chunks
+
+
+def quote_periods(data):
+    return re.sub(rb'(?m)^\.', b'..', data)
+
 
 class SMTPSender:
-    def __init__(self, smtp_server, smtp_port, username, password):
+    """
+    Sends messages through a pool of authenticated SMTP sessions
+    that are reused between messages. At most pool_size sessions
+    are open at the same time, and transient failures are retried
+    with exponential backoff.
+    """
+
+    def __init__(self, smtp_server, smtp_port, username, password, pool_size=1, use_tls=True, max_retries=3, backoff=0.5, timeout=30):
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
         self.username = username
         self.password = password
+        self.use_tls = use_tls
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.idle_sessions = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(pool_size)
 
-    def send(self, msg):
-        try:
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+    def _connect(self):
+        with metrics.time('email.connect'):
+            server = smtplib.SMTP(self.smtp_server, self.smtp_port, timeout=self.timeout)
             server.ehlo()
-            server.starttls()
-            server.login(self.username, self.password)
-            server.sendmail(msg['From'], msg['To'], msg.as_string())
+
+            if self.use_tls:
+                server.starttls()
+                server.ehlo()
+
+            if self.username:
+                server.login(self.username, self.password)
+
+        return server
+
+    def _acquire(self):
+        self.slots.acquire()
+        try:
+            return self.idle_sessions.get_nowait()
+        except queue.Empty:
+            pass
+
+        try:
+            return self._connect()
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def _release(self, server, broken=False):
+        if broken:
+            self._quit(server)
+        else:
+            self.idle_sessions.put(server)
+        self.slots.release()
+
+    def _quit(self, server):
+        try:
             server.quit()
-        except Exception as e:
-            print(f'Erro ao enviar e-mail: {e}')
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def close(self):
+        while True:
+            try:
+                self._quit(self.idle_sessions.get_nowait())
+            except queue.Empty:
+                return
+
+    def _is_transient(self, error):
+        if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+            return True
+        if isinstance(error, smtplib.SMTPResponseException):
+            return 400 <= error.smtp_code < 500
+        # SMTPException is an OSError, but the other SMTP errors (refused
+        # recipients, unsupported commands...) fail the same way again.
+        if isinstance(error, smtplib.SMTPException):
+            return False
+        return isinstance(error, OSError)
+
+    def _sendmail(self, server, sender, recipients, chunks):
+        """
+        Same protocol as smtplib.SMTP.sendmail, but the message
+        is written to the socket chunk by chunk.
+        """
+        server.ehlo_or_helo_if_needed()
+        code, response = server.mail(sender)
+
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, response, sender)
+
+        refused = {}
+        for recipient in recipients:
+            code, response = server.rcpt(recipient)
+            if code not in (250, 251):
+                refused[recipient] = (code, response)
+
+        if len(refused) == len(recipients):
+            server.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        code, response = server.docmd('data')
+        if code != 354:
+            raise smtplib.SMTPDataError(code, response)
+
+        for chunk in chunks:
+            server.send(chunk)
+        server.send(b'.\r\n')
+
+        code, response = server.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, response)
+
+        return refused
+
+    def send(self, msg):
+        """
+        Send the message and return a dictionary with the
+        result of each recipient: None when it was accepted
+        or the error message otherwise.
+        """
+        with metrics.time('email.send'):
+            results = self._send(msg)
+
+        failed = sum(error is not None for error in results.values())
+        metrics.incr('email.recipients.sent', len(results) - failed)
+        metrics.incr('email.recipients.failed', failed)
+        return results
+
+    def _send(self, msg):
+        recipients = [address.strip() for address in msg['To'].split(',')]
+        chunks = message_chunks(msg)
+        attempt = 0
+
+        while True:
+            attempt += 1
+            server = None
+
+            try:
+                server = self._acquire()
+                refused = self._sendmail(server, msg['From'], recipients, chunks)
+                self._release(server)
+                return {
+                    recipient: str(refused[recipient]) if recipient in refused else None
+                    for recipient in recipients
+                }
+            except Exception as e:
+                if server is not None:
+                    self._release(server, broken=not isinstance(e, smtplib.SMTPRecipientsRefused))
+
+                if not self._is_transient(e) or attempt > self.max_retries:
+                    error = getattr(e, 'recipients', None)
+                    if error:
+                        return {recipient: str(error.get(recipient, e)) for recipient in recipients}
+                    return {recipient: f'{type(e).__name__}: {e}' for recipient in recipients}
+
+                delay = self.backoff * 2 ** (attempt - 1)
+                metrics.incr('email.retries')
+                logging.warning(f'Falha temporária ao enviar e-mail ({e}), nova tentativa em {delay}s...')
+                time.sleep(delay)
 
 
 class EmailService:
@@ -67,25 +357,91 @@ class EmailService:
         self.email_sender = email_sender
         self.sender = sender
 
-    def send_email(self, body, subject, recipient, attachment_path=None):
+    def send_email(self, body, subject, recipient, attachment_path=None, attachment_content=None):
+        """
+        Send the e-mail with the file at attachment_path or, when
+        attachment_content is given, with that content attached
+        under the attachment_path file name.
+        """
         builder = EmailMessageBuilder(self.sender, recipient, subject, body)
         msg = builder.create_message()
 
         if attachment_path:
-            attachment = EmailAttachment(attachment_path)
+            attachment = EmailAttachment(attachment_path, attachment_content)
             attachment.attach(msg)
 
-        self.email_sender.send(msg)
+        return self.email_sender.send(msg)
 
 
-SMTP_SERVER = ''
-SMTP_PORT = 587
-USERNAME = ''
-PASSWORD = ''
+class EmailDispatcher:
+    """
+    Queue of e-mails delivered by background threads, so the
+    messages are sent while the next reports are rendered.
+    The concurrency should not exceed the SMTP pool size.
+    """
+
+    def __init__(self, email_service, concurrency=1):
+        self.email_service = email_service
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.deliveries = []
+
+    def submit(self, body, subject, recipient, attachment_path=None, attachment_content=None):
+        future = self.executor.submit(
+            self.email_service.send_email,
+            body=body,
+            subject=subject,
+            recipient=recipient,
+            attachment_path=attachment_path,
+            attachment_content=attachment_content
+        )
+        self.deliveries.append((recipient, future))
+        return future
+
+    def results(self):
+        """
+        Wait for every queued e-mail and yield (recipient, results)
+        in the order they were submitted.
+        """
+        for recipient, future in self.deliveries:
+            try:
+                yield recipient, future.result()
+            except Exception as e:
+                yield recipient, {recipient: f'{type(e).__name__}: {e}'}
+
+        self.deliveries = []
+
+    def close(self, close_sessions=True):
+        """Wait for the queued e-mails and, unless told otherwise, close the SMTP sessions."""
+        self.executor.shutdown(wait=True)
+        if close_sessions:
+            self.email_service.email_sender.close()
+
+
+def email_service_from_env(environ=None) -> EmailService:
+    """
+    Build the e-mail service from the environment variables
+    NIMBUS_SMTP_SERVER, NIMBUS_SMTP_PORT, NIMBUS_SMTP_USERNAME,
+    NIMBUS_SMTP_PASSWORD, NIMBUS_SMTP_SENDER (the username by
+    default), NIMBUS_SMTP_POOL_SIZE and NIMBUS_SMTP_TLS (0 to
+    skip STARTTLS).
+    """
+    environ = os.environ if environ is None else environ
+    smtp_server = environ.get('NIMBUS_SMTP_SERVER', '')
+
+    if not smtp_server:
+        raise ValueError('Servidor SMTP não configurado: defina a variável NIMBUS_SMTP_SERVER')
 
-smtp_sender = SMTPSender(SMTP_SERVER, SMTP_PORT, USERNAME, PASSWORD)
+    username = environ.get('NIMBUS_SMTP_USERNAME', '')
+    smtp_sender = SMTPSender(
+        smtp_server,
+        int(environ.get('NIMBUS_SMTP_PORT', SMTP_PORT)),
+        username,
+        environ.get('NIMBUS_SMTP_PASSWORD', ''),
+        pool_size=int(environ.get('NIMBUS_SMTP_POOL_SIZE', SMTP_POOL_SIZE)),
+        use_tls=environ.get('NIMBUS_SMTP_TLS', '1') != '0',
+    )
 
-email_service = EmailService(
-    email_sender=smtp_sender,
-    sender=USERNAME,
-)
+    return EmailService(
+        email_sender=smtp_sender,
+        sender=environ.get('NIMBUS_SMTP_SENDER', username),
+    )
@@ -0,0 +1,103 @@
+import queue
+import random
+import logging
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOG_MODES = ('async', 'sync')
+
+# Extra of the per-connection/per-report records, which are subject to sampling.
+SAMPLED = {'sampled': True}
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction `rate` of the records logged with
+    extra=SAMPLED. Every other record always passes.
+    """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1.0 or not getattr(record, 'sampled', False):
+            return True
+        return random.random() < self.rate
+
+
+class SingleLineFormatter(logging.Formatter):
+    """Formatter that escapes line breaks, so every record is a single line."""
+
+    def format(self, record):
+        return super().format(record).replace('\r', '\\r').replace('\n', '\\n')
+
+
+_listener = None
+_queue_handler = None
+
+
+def configure_logging(mode='async', sample_rate=1.0):
+    """
+    Apply the sampling and single-line format to the handlers of
+    the root logger. In async mode the handlers are moved behind a
+    queue served by a background thread, so logging a record never
+    waits for the disk.
+    """
+    global _listener, _queue_handler
+
+    if mode not in LOG_MODES:
+        raise ValueError(f'Modo de log inválido: {mode}')
+
+    root = logging.getLogger()
+    handlers = [handler for handler in root.handlers if handler is not _queue_handler]
+    sampling = SamplingFilter(sample_rate)
+
+    for handler in handlers:
+        fmt = handler.formatter._fmt if handler.formatter else None
+        handler.setFormatter(SingleLineFormatter(fmt))
+
+    if mode == 'sync':
+        for handler in handlers:
+            handler.addFilter(sampling)
+        return
+
+    for handler in handlers:
+        root.removeHandler(handler)
+
+    _queue_handler = QueueHandler(queue.SimpleQueue())
+    _queue_handler.addFilter(sampling)
+    root.addHandler(_queue_handler)
+
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def use_direct_logging():
+    """
+    Log straight to the handlers again, without the queue. Used by
+    forked worker processes, which don't inherit the listener thread.
+    """
+    global _listener, _queue_handler
+
+    if _queue_handler is None:
+        return
+
+    root = logging.getLogger()
+    root.removeHandler(_queue_handler)
+
+    for handler in _listener.handlers:
+        for log_filter in _queue_handler.filters:
+            handler.addFilter(log_filter)
+        root.addHandler(handler)
+
+    _listener = None
+    _queue_handler = None
+
+
+def stop_logging():
+    """Write the records still in the queue and stop the background thread."""
+    if _listener is not None:
+        _listener.stop()
+
+    use_direct_logging()
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+
+# Upper bounds, in seconds, of the latency buckets: 1µs to 10s, four per decade.
+LATENCY_BUCKETS = tuple(1e-6 * 10 ** (i / 4) for i in range(29))
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets, so recording a value is
+    a binary search and the percentiles are estimated from the
+    bucket bounds.
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, counts, total, maximum):
+        for i, count in enumerate(counts):
+            self.counts[i] += count
+        self.count += sum(counts)
+        self.total += total
+        self.max = max(self.max, maximum)
+
+    def quantile(self, q):
+        rank = q * self.count
+        cumulative = 0
+
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.total, 6),
+            'avg': round(self.total / self.count, 6) if self.count else 0.0,
+            'max': round(self.max, 6),
+            'p50': round(self.quantile(0.5), 6),
+            'p90': round(self.quantile(0.9), 6),
+            'p99': round(self.quantile(0.99), 6),
+        }
+
+
+class Metrics:
+    """
+    Counters and latency histograms of the hot path stages. The
+    stages listed in profile_stages are also run under cProfile,
+    one profiler per thread, merged when the profiles are dumped.
+    """
+
+    def __init__(self, profile_stages=()):
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.profile_stages = set(profile_stages)
+        self.profiles = []
+        self.profiling = threading.local()
+
+    def incr(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        """Record the duration of the block in the stage histogram."""
+        profile = self._start_profile(stage) if stage in self.profile_stages else None
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+            if profile is not None:
+                profile.disable()
+                self.profiling.active = False
+
+    def _start_profile(self, stage):
+        # cProfile can't nest, so a stage inside a profiled stage is only timed.
+        if getattr(self.profiling, 'active', False):
+            return None
+
+        profiles = getattr(self.profiling, 'profiles', None)
+        if profiles is None:
+            profiles = self.profiling.profiles = {}
+
+        profile = profiles.get(stage)
+        if profile is None:
+            # Imported on demand, since profiling is seldom enabled.
+            import cProfile
+
+            profile = profiles[stage] = cProfile.Profile()
+            with self.lock:
+                self.profiles.append((stage, profile))
+
+        self.profiling.active = True
+        profile.enable()
+        return profile
+
+    def collect(self):
+        """
+        Return the raw counters and histograms recorded so far and
+        reset them, so another process can merge them.
+        """
+        with self.lock:
+            raw = {
+                'counters': self.counters,
+                'histograms': {
+                    name: (histogram.counts, histogram.total, histogram.max)
+                    for name, histogram in self.histograms.items()
+                },
+            }
+            self.counters = {}
+            self.histograms = {}
+        return raw
+
+    def merge(self, raw):
+        with self.lock:
+            for name, value in raw['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+            for name, (counts, total, maximum) in raw['histograms'].items():
+                histogram = self.histograms.get(name)
+                if histogram is None:
+                    histogram = self.histograms[name] = Histogram()
+                histogram.merge(counts, total, maximum)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'uptime': round(time.time() - self.started_at, 3),
+                'counters': dict(sorted(self.counters.items())),
+                'latency': {name: self.histograms[name].snapshot() for name in sorted(self.histograms)},
+            }
+
+    def dump(self, path):
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.snapshot(), file, indent=2, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def dump_profiles(self, directory='profiles'):
+        """Write one pstats file per profiled stage, merging every thread."""
+        with self.lock:
+            by_stage = {}
+            for stage, profile in self.profiles:
+                by_stage.setdefault(stage, []).append(profile)
+
+        if not by_stage:
+            return
+
+        import pstats
+
+        os.makedirs(directory, exist_ok=True)
+
+        for stage, profiles in by_stage.items():
+            stats = pstats.Stats(*profiles)
+            stats.dump_stats(os.path.join(directory, f'{stage}.prof'))
+
+
+metrics = Metrics()
+
+
+class MetricsDumper:
+    """Background thread that writes the metrics to a JSON file every interval seconds."""
+
+    def __init__(self, metrics, path, interval=10.0):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._dump()
+
+    def _dump(self):
+        try:
+            self.metrics.dump(self.path)
+        except OSError as e:
+            logging.error(f'Erro ao gravar as métricas: {e}')
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self._dump()
+
+
+async def serve_metrics(metrics, host='localhost', port=9100):
+    """
+    Local HTTP endpoint that answers any request with
+    the current metrics as JSON.
+    """
+    import asyncio
+
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+
+        body = json.dumps(metrics.snapshot(), indent=2, ensure_ascii=False).encode('utf-8')
+        writer.write(
+            b'HTTP/1.1 200 OK\r\n'
+            b'Content-Type: application/json; charset=utf-8\r\n'
+            + f'Content-Length: {len(body)}\r\n'.encode('ascii')
+            + b'Connection: close\r\n\r\n'
+            + body
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    return await asyncio.start_server(handle, host=host, port=port)
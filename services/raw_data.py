@@ -0,0 +1,229 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+from services.time_index import index_sections, window_indexes
+
+
+SECTIONS = {
+    'análise': 'Análise',
+    'previsao': 'Previsão',
+}
+JSON_LINES_EXTENSIONS = ('.jsonl', '.ndjson')
+SECTION_FIELD = 'secao'
+NUMBER_CHARS = '0123456789+-.eE'
+
+
+class IncrementalJSONReader:
+    """
+    Reads a JSON object whose values are lists, like bruto.txt,
+    yielding (key, item) for every list item while keeping only
+    the item being decoded in memory.
+    """
+
+    def __init__(self, file, chunk_size=64 * 1024):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.file.read(self.chunk_size)
+
+        if not chunk:
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+                self.pos += 1
+
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+
+            if not self._fill():
+                return ''
+
+    def _next_char(self):
+        char = self._peek()
+        self.pos += 1
+        return char
+
+    def _expect(self, expected):
+        char = self._next_char()
+
+        if char != expected:
+            raise ValueError(f'JSON inválido: esperado {expected!r}, encontrado {char!r}')
+
+    def _decode(self):
+        self._peek()
+
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+
+            # A number at the end of the buffer may continue in the next chunk.
+            if not self.buffer[end:].strip(NUMBER_CHARS) and not self.eof and self._fill():
+                continue
+
+            self.pos = end
+            return value
+
+    def __iter__(self):
+        self._expect('{')
+
+        if self._peek() == '}':
+            return
+
+        while True:
+            key = self._decode()
+            self._expect(':')
+
+            if self._peek() == '[':
+                self._next_char()
+
+                if self._peek() == ']':
+                    self._next_char()
+                else:
+                    while True:
+                        yield key, self._decode()
+                        char = self._next_char()
+
+                        if char == ']':
+                            break
+                        if char != ',':
+                            raise ValueError(f'JSON inválido: esperado "," ou "]", encontrado {char!r}')
+            else:
+                self._decode()
+
+            char = self._next_char()
+
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError(f'JSON inválido: esperado "," ou "}}", encontrado {char!r}')
+
+
+def iter_json_lines(file):
+    """
+    Yield (key, item) from the JSON-lines variant of the raw file,
+    where each line is an item with its section in the `secao` field.
+    """
+    for line in file:
+        if not line.strip():
+            continue
+
+        item = json.loads(line)
+        yield item.pop(SECTION_FIELD, None), item
+
+
+class SectionItems:
+    """
+    Re-iterable view of the items of one section. Every iteration
+    streams the raw file again, so only one item is held in memory.
+    """
+
+    def __init__(self, raw_data, key):
+        self.raw_data = raw_data
+        self.key = key
+
+    def __iter__(self):
+        for key, item in self.raw_data.iter_items():
+            if key == self.key:
+                yield item
+
+
+class RawWeatherData:
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def is_json_lines(self):
+        return os.path.splitext(self.filepath)[1].lower() in JSON_LINES_EXTENSIONS
+
+    def iter_items(self):
+        with open(self.filepath, 'r') as file:
+            if self.is_json_lines():
+                yield from iter_json_lines(file)
+            else:
+                yield from IncrementalJSONReader(file)
+
+    def load(self):
+        """Parse the whole file, returning a list of items per section key."""
+        if not self.is_json_lines():
+            with open(self.filepath, 'r') as file:
+                return json.load(file)
+
+        file_data = {}
+        for key, item in self.iter_items():
+            file_data.setdefault(key, []).append(item)
+        return file_data
+
+    def section_list(self, stream=False):
+        """
+        Sections in the format expected by ReportPDF. When streaming,
+        the items are read from the file while the report is drawn.
+        """
+        if stream:
+            return [{name: SectionItems(self, key)} for key, name in SECTIONS.items()]
+
+        file_data = self.load()
+        return [{name: file_data.get(key, [])} for key, name in SECTIONS.items()]
+
+
+class RawDataCache:
+    """
+    Parsed weather files kept in memory between report runs,
+    reused while the file is unchanged, along with the time
+    index of their sections once a window is asked for. The
+    least recently used file is dropped beyond max_files.
+    """
+
+    def __init__(self, max_files=4):
+        self.max_files = max_files
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _entry(self, filepath):
+        stat = os.stat(filepath)
+        key = (os.path.realpath(filepath), stat.st_mtime_ns, stat.st_size)
+
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        entry = {'sections': RawWeatherData(filepath).section_list(), 'indexes': None}
+
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.max_files:
+                self.entries.popitem(last=False)
+
+        return entry
+
+    def section_list(self, filepath, stream=False):
+        if stream:
+            return RawWeatherData(filepath).section_list(stream=True)
+
+        return self._entry(filepath)['sections']
+
+    def window_sections(self, filepath, date, lookback=None, lookahead=None):
+        """Sections of the file inside the window around date, see time_index.window_sections."""
+        entry = self._entry(filepath)
+
+        if entry['indexes'] is None:
+            entry['indexes'] = index_sections(entry['sections'])
+
+        return window_indexes(entry['indexes'], date, lookback, lookahead)
@@ -1,44 +1,228 @@
+import copy
+import zlib
+import itertools
 from datetime import datetime
 
 from fpdf import FPDF
+from fpdf.fonts import fpdf_charwidths
+
+from services.metrics import metrics
+from services.report_output import output_report
+from services.report_storage import ReportStorage
+
+
+class RenderContext:
+    """
+    Values shared by every report rendered in a run, computed
+    only once: the creation date, the storage the reports are
+    written to, the PDF operators of the fill colours and the
+    measured height of each item.
+    """
+    MAX_CACHED_HEIGHTS = 100000
+
+    def __init__(self, storage: ReportStorage = None) -> None:
+        self.date = datetime.now().strftime('%d/%m/%Y')
+        self.storage = storage if storage is not None else ReportStorage()
+        self.fill_colors = {}
+        self.item_heights = {}
+
+    def fill_color(self, color) -> str:
+        """Same operator FPDF.set_fill_color keeps in pdf.fill_color."""
+        if color not in self.fill_colors:
+            r, g, b = color
+            if r == 0 and g == 0 and b == 0:
+                self.fill_colors[color] = '%.3f g' % (r / 255.0)
+            else:
+                self.fill_colors[color] = '%.3f %.3f %.3f rg' % (r / 255.0, g / 255.0, b / 255.0)
+        return self.fill_colors[color]
+
+    def cache_item_height(self, key, height):
+        if len(self.item_heights) >= self.MAX_CACHED_HEIGHTS:
+            self.item_heights.clear()
+        self.item_heights[key] = height
+
+
+class CompactFPDF(FPDF):
+    """
+    FPDF for the compact output: the page furniture drawn by
+    ReportPDF.add_box is written once, as form XObjects the pages
+    refer to, every stream is compressed and the fonts no page
+    uses are left out of the resources.
+    """
+    # Object line, stream keywords, xref entry and /XObject entry of a form.
+    FORM_OBJECT_OVERHEAD = 80
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.set_compression(True)
+        # Operators of each form -> its number, in the order they were added.
+        self.forms = {}
+        # Number of each form -> the operators that draw it on the pages.
+        self.form_calls = {}
+        self.form_objects = {}
+        self.forms_inlined = False
+
+    def draw_as_form(self, start):
+        """
+        Move the operators written to the current page since start
+        into a form XObject, shared with every page that draws the
+        same ones. The form runs in a saved graphics state, so the
+        font and fill colour FPDF expects afterwards are set again.
+        """
+        page = self.pages[self.page]
+        number = self.forms.setdefault(page[start:], len(self.forms) + 1)
+        operators = [f'/Fm{number} Do']
+
+        if self.current_font:
+            operators.append('BT /F%d %.2f Tf ET' % (self.current_font['i'], self.font_size_pt))
+        operators.append(self.fill_color)
+
+        call = '\n'.join(operators) + '\n'
+        self.form_calls.setdefault(number, set()).add(call)
+        self.pages[self.page] = page[:start] + call
+
+    def inline_forms(self):
+        """
+        Write back into the pages, as the operators they replaced,
+        the forms whose object takes more space than they save in
+        the compressed page streams. Every form starts inlined and
+        is only kept when it makes the output smaller, so the
+        compact output is never larger than the boxes drawn on
+        every page.
+        """
+        if self.forms_inlined:
+            return
+        self.forms_inlined = True
+
+        drawn = dict(self.pages)
+        inlined = set(self.forms.values())
+        self.pages = {number: self._inline(page, inlined) for number, page in drawn.items()}
+        sizes = {number: self._compressed_size(page) for number, page in self.pages.items()}
+
+        for operators, number in self.forms.items():
+            kept = inlined - {number}
+            pages = {
+                page_number: self._inline(page, kept)
+                for page_number, page in drawn.items()
+                if any(call in page for call in self.form_calls[number])
+            }
+            page_sizes = {page_number: self._compressed_size(page) for page_number, page in pages.items()}
+            saved = sum(sizes[page_number] - size for page_number, size in page_sizes.items())
+
+            if saved > self._form_object_size(operators):
+                inlined = kept
+                self.pages.update(pages)
+                sizes.update(page_sizes)
+
+        self.forms = {operators: number for operators, number in self.forms.items() if number not in inlined}
+
+    def _inline(self, page, numbers):
+        """Page with the calls to the given forms replaced by their operators."""
+        for operators, number in self.forms.items():
+            if number in numbers:
+                for call in self.form_calls[number]:
+                    page = page.replace(call, operators)
+        return page
+
+    @staticmethod
+    def _compressed_size(page) -> int:
+        return len(zlib.compress(page.encode('latin-1')))
+
+    def _form_object(self, operators):
+        """Dictionary and compressed stream of the form object drawing operators."""
+        width, height = (self.fw_pt, self.fh_pt) if self.def_orientation == 'P' else (self.fh_pt, self.fw_pt)
+        content = zlib.compress(operators.encode('latin-1'))
+        dictionary = (
+            '<</Type /XObject /Subtype /Form /BBox [0 0 %.2f %.2f] /Resources 2 0 R '
+            '/Filter /FlateDecode /Length %d>>' % (width, height, len(content))
+        )
+        return dictionary, content
+
+    def _form_object_size(self, operators) -> int:
+        dictionary, content = self._form_object(operators)
+        return len(dictionary) + len(content) + self.FORM_OBJECT_OVERHEAD
+
+    def _putpages(self):
+        self.inline_forms()
+        super()._putpages()
+
+    def _putresources(self):
+        used = ''.join(self.pages.values()) + ''.join(self.forms)
+        self.fonts = {key: font for key, font in self.fonts.items() if f'/F{font["i"]} ' in used}
+        super()._putresources()
+
+    def _putimages(self):
+        super()._putimages()
+        self.form_objects = {}
+
+        for operators, number in self.forms.items():
+            dictionary, content = self._form_object(operators)
+            self._newobj()
+            self.form_objects[number] = self.n
+            self._out(dictionary)
+            self._putstream(content)
+            self._out('endobj')
+
+    def _putxobjectdict(self):
+        super()._putxobjectdict()
+        for number, n in self.form_objects.items():
+            self._out(f'/Fm{number} {n} 0 R')
 
 
 class Report:
-    def __init__(self, pdf: FPDF) -> None:
+    WIDTH_PDF_AREA = 210 - 40
+    HEIGHT_PDF_AREA = 297 - 20
+    HEADER_FONT_SIZE = 12
+    X_MARGIN = 20
+    Y_MARGIN = 10
+    CELL_HEIGHT = 10
+    INDENT_MESSAGE = '\u00A0' * 35
+    BLACK = (0,0,0)
+    WHITE = (255,255,255)
+    RED = (255,0,0)
+    GRAY = (85,85,85)
+
+    WIDTH_BOX = 170
+    HEIGHT_BOX = 110
+    X_MARGIN_BOX = 20
+    Y_MARGIN_TOP_BOX = 30
+    Y_MARGIN_BOTTOM_BOX = 148
+    BOX_HEADER_HEIGHT = 30
+
+    LINE_HEIGHT = 4
+    PHENOMENON_HEIGHT = 5
+    MESSAGE_FONT_SIZE = 9
+    MESSAGE_CHAR_WIDTHS = fpdf_charwidths['helvetica']
+
+    def __init__(self, pdf: FPDF, context: RenderContext = None) -> None:
         self.pdf = pdf
-        self.WIDTH_PDF_AREA = 210 - 40
-        self.HEIGHT_PDF_AREA = 297 - 20
-        self.HEADER_FONT_SIZE = 12
-        self.X_MARGIN = 20
-        self.Y_MARGIN = 10
-        self.CELL_HEIGHT = 10
-        self.INDENT_MESSAGE = '\u00A0' * 35
-        self.BLACK = (0,0,0)
-        self.WHITE = (255,255,255)
-        self.RED = (255,0,0)
-        self.GRAY = (85,85,85)
-
-        self.WIDTH_BOX = 170
-        self.HEIGHT_BOX = 110
-        self.X_MARGIN_BOX = 20
-        self.Y_MARGIN_TOP_BOX = 30
-        self.Y_MARGIN_BOTTOM_BOX = 148
+        self.context = context if context is not None else RenderContext()
 
     def _get_date(self) -> str:
-        return datetime.now().strftime('%d/%m/%Y')
+        return self.context.date
+
+    def _set_font(self, style, size):
+        """Select Arial, only when it changes the current font."""
+        pdf = self.pdf
+        if pdf.font_family == 'helvetica' and pdf.font_style == style and pdf.font_size_pt == size:
+            return
+        pdf.set_font('Arial', style, size)
+
+    def _set_fill_color(self, color):
+        """Set the fill colour, only when it changes the current one."""
+        if self.pdf.fill_color != self.context.fill_color(color):
+            self.pdf.set_fill_color(*color)
 
 
 class BuildReportHeader(Report):
-    def __init__(self, pdf: FPDF) -> None:
-        self.BLUE = (5,55,95)
-        self.ORANGE = (255,170,60)
-        super().__init__(pdf)
+    BLUE = (5,55,95)
+    ORANGE = (255,170,60)
 
     def make_pdf_header(self, title, x_margin_box, y_margin_box, width_box) -> FPDF:
         self.pdf.set_xy(x_margin_box, y_margin_box)
-        self.pdf.set_font('Arial', 'B', 16)
+        self._set_font('B', 16)
         self.pdf.set_text_color(*self.WHITE)
-        self.pdf.set_fill_color(*self.BLUE)
+        self._set_fill_color(self.BLUE)
         self.pdf.cell(
             w=width_box, 
             h=self.CELL_HEIGHT + 1, 
@@ -48,7 +232,7 @@ class BuildReportHeader(Report):
             fill=True
         )
         self.pdf.set_xy(x_margin_box, y_margin_box+11)
-        self.pdf.set_fill_color(*self.ORANGE)
+        self._set_fill_color(self.ORANGE)
         self.pdf.cell(width_box, 2, ln=True, fill=True)
         self.pdf.set_text_color(*self.BLACK)
 
@@ -56,14 +240,12 @@ class BuildReportHeader(Report):
 
 
 class ReportClientName(Report):
-    def __init__(self, pdf: FPDF, ) -> None:
-        super().__init__(pdf)
 
     def add_client_name(self, client_name, x_margin_box, client_section_y) -> FPDF:
         self.pdf.set_xy(x_margin_box, client_section_y)
-        self.pdf.set_font('Arial', 'B', self.HEADER_FONT_SIZE)
+        self._set_font('B', self.HEADER_FONT_SIZE)
         self.pdf.cell(17, self.CELL_HEIGHT, f"Cliente:", align='L')
-        self.pdf.set_font('Arial', "", self.HEADER_FONT_SIZE)
+        self._set_font('', self.HEADER_FONT_SIZE)
         self.pdf.cell(80, self.CELL_HEIGHT, client_name.capitalize(), align='L')
 
         return self.pdf
@@ -71,20 +253,61 @@ class ReportClientName(Report):
 
 class ReportDate(Report):
     def add_date(self):
-        self.pdf.set_font('Arial', 'B', self.HEADER_FONT_SIZE)
+        self._set_font('B', self.HEADER_FONT_SIZE)
         self.pdf.cell(40, self.CELL_HEIGHT, f"Data de confecção:", align='R')
-        self.pdf.set_font('Arial', "", self.HEADER_FONT_SIZE)
+        self._set_font('', self.HEADER_FONT_SIZE)
         self.pdf.cell(23, self.CELL_HEIGHT, self._get_date(), ln=True, align='R')
 
         return self.pdf
 
 
 class ReportHeader(Report):
+    """
+    Header drawn at the top of every box. The helpers that
+    draw each part are built once and reused for every box,
+    and the operators of a header already drawn in the same
+    position and state of this document are replayed. The cache
+    belongs to the document, since the operators refer to its
+    fonts and the replayed state includes its current font.
+    """
+    # FPDF attributes the header operators depend on, or change.
+    STATE_KEYS = (
+        'font_family', 'font_style', 'font_size_pt', 'underline', 'fill_color',
+        'text_color', 'draw_color', 'color_flag', 'x', 'y', 'l_margin', 'ws'
+    )
+    STATE_ATTRIBUTES = STATE_KEYS + ('font_size', 'current_font', 'unifontsubset', 'lasth')
+
+    def __init__(self, pdf: FPDF, context: RenderContext = None) -> None:
+        super().__init__(pdf, context)
+        self.report_title = BuildReportHeader(pdf, self.context)
+        self.report_client_name = ReportClientName(pdf, self.context)
+        self.report_date = ReportDate(pdf, self.context)
+        self.headers = {}
 
     def add_header(self, x_margin_box, y_margin_box, width_box, client_data, section):
+        pdf = self.pdf
+        key = (x_margin_box, y_margin_box, width_box, client_data['name'], section) + tuple(
+            getattr(pdf, attribute) for attribute in self.STATE_KEYS
+        )
+        header = self.headers.get(key)
+
+        if header is not None:
+            operators, state = header
+            pdf.pages[pdf.page] += operators
+            for attribute, value in state.items():
+                setattr(pdf, attribute, value)
+            return pdf
+
+        start = len(pdf.pages[pdf.page])
+        self.draw_header(x_margin_box, y_margin_box, width_box, client_data, section)
+        state = {attribute: getattr(pdf, attribute) for attribute in self.STATE_ATTRIBUTES}
+        self.headers[key] = (pdf.pages[pdf.page][start:], state)
+
+        return pdf
+
+    def draw_header(self, x_margin_box, y_margin_box, width_box, client_data, section):
         
-        pdf = BuildReportHeader(pdf=self.pdf)
-        pdf = pdf.make_pdf_header(
+        self.report_title.make_pdf_header(
             'Relatório Meteorológico', 
             x_margin_box, 
             y_margin_box, 
@@ -92,35 +315,40 @@ class ReportHeader(Report):
         )
         
         client_section_y = y_margin_box + self.CELL_HEIGHT + 2
-        pdf = ReportClientName(pdf=self.pdf)
-        pdf = pdf.add_client_name(
+        self.report_client_name.add_client_name(
             client_name=client_data['name'], 
             x_margin_box=x_margin_box + 5, 
             client_section_y=client_section_y
         )
 
-        pdf = ReportDate(pdf=self.pdf)
-        pdf = pdf.add_date()
+        self.report_date.add_date()
         
-        self.pdf.set_xy(x_margin_box + 5, client_section_y + 9)
-        self.pdf.set_font('Arial', 'B', self.HEADER_FONT_SIZE)
+        if section is not None:
+            self.add_section_name(x_margin_box, y_margin_box, section)
+
+        return self.pdf
+
+    def add_section_name(self, x_margin_box, y_margin_box, section):
+        self.pdf.set_xy(x_margin_box + 5, y_margin_box + self.CELL_HEIGHT + 11)
+        self._set_font('B', self.HEADER_FONT_SIZE)
         self.pdf.cell(100, self.CELL_HEIGHT, section, ln=True)
-        self.pdf.set_font('Arial', '', 12)
-        pdf.set_left_margin(x_margin_box + 5)
+        self._set_font('', 12)
+        self.pdf.set_left_margin(x_margin_box + 5)
 
         return self.pdf
 
 
 class ReportPDF(Report):
-    def __init__(self, client_data, pdf, report_header) -> None:
+    def __init__(self, client_data, pdf, report_header, context: RenderContext = None) -> None:
         self.report_header = report_header
         self.client_data = client_data
-        super().__init__(pdf)
+
+        if context is None and report_header is not None:
+            context = report_header.context
+        super().__init__(pdf, context)
 
     def _get_pdf_file_path(self):
-        date = self._get_date().replace("/", "")
-        phone = self.client_data['phone_number']
-        return f"reports/relatorio_meteorologico_{phone}_{date}.pdf"
+        return self.context.storage.report_path(self.client_data['phone_number'], self._get_date())
 
     def _get_date_hour(self, section):
         date, hour = section['data'].split('T')
@@ -140,33 +368,178 @@ class ReportPDF(Report):
             self.HEIGHT_BOX
         )
 
-    def message_height(self, msg, box_width):
+    def wrap_lines(self, txt, width):
+        """
+        (start, end) of each line multi_cell breaks the text into,
+        using the glyph widths of the message font and the same
+        wrapping rules, without printing anything to the PDF. The
+        positions are in the text without carriage returns, and
+        exclude the space or newline the line was broken at.
+        """
+        char_widths = self.MESSAGE_CHAR_WIDTHS
+        max_width = (width - 2 * self.pdf.c_margin) * 1000.0 / (self.MESSAGE_FONT_SIZE / self.pdf.k)
+        text = txt.replace('\r', '')
+        length = len(text)
+
+        if length > 0 and text[-1] == '\n':
+            length -= 1
+
+        separator = -1
+        i = 0
+        line_start = 0
+        line_width = 0
+        lines = []
+
+        while i < length:
+            char = text[i]
+
+            if char == '\n':
+                lines.append((line_start, i))
+                i += 1
+                separator = -1
+                line_start = i
+                line_width = 0
+                continue
+
+            if char == ' ':
+                separator = i
+
+            line_width += char_widths.get(char, 0)
+
+            if line_width > max_width:
+                if separator == -1:
+                    if i == line_start:
+                        i += 1
+                    lines.append((line_start, i))
+                else:
+                    lines.append((line_start, separator))
+                    i = separator + 1
+
+                separator = -1
+                line_start = i
+                line_width = 0
+            else:
+                i += 1
+
+        lines.append((line_start, length))
+        return lines
+
+    def count_lines(self, txt, width):
+        """Number of lines multi_cell breaks the text into, see wrap_lines."""
+        return len(self.wrap_lines(txt, width))
+
+    def _message(self, item):
+        return f"{self.INDENT_MESSAGE}{item.get('mensagem', '').strip()}"
+
+    def _head_height(self, item):
+        """Height of the phenomenon and the spacing above the first message line."""
+        return 1 + (self.PHENOMENON_HEIGHT if 'fenomeno' in item else 0)
+
+    def item_height(self, item):
         """
-        Method for calculating the required height for a message, 
-        without actually printing it to the PDF.
+        Height taken by an item drawn with add_content_to_pdf,
+        including the blank line that follows the message.
         """
-        return self.pdf.get_string_width(msg) / box_width * self.CELL_HEIGHT
+        key = ('fenomeno' in item, item.get('mensagem', ''))
+        height = self.context.item_heights.get(key)
+
+        if height is None:
+            lines = self.count_lines(self._message(item), self.WIDTH_BOX - self.X_MARGIN_BOX / 2)
+            height = self._head_height(item) + lines * self.LINE_HEIGHT + self.LINE_HEIGHT
+            self.context.cache_item_height(key, height)
 
-    def can_fit_message(self, msg, current_y_position, box_start_y, box_height, box_width):
+        return height
+
+    def paginate(self, section_items):
         """
-        Checks whether the message fits in the 
-        available space on the board.
+        Assign every item of a section to a box before anything
+        is drawn. Yields (box_y, y, item, lines): the boxes alternate
+        between the top and bottom of each page, and an item only
+        moves to the next box when it doesn't fit in the space left.
+        An item taller than an empty box is split by its message
+        lines across boxes, with lines the (first, stop) range of
+        the lines drawn in each one, or None for the whole item.
         """
-        message_height = self.message_height(msg, box_width)
-        available_space = box_start_y + box_height - current_y_position
+        boxes = itertools.cycle((self.Y_MARGIN_TOP_BOX, self.Y_MARGIN_BOTTOM_BOX))
+        box_y = next(boxes)
+        y = box_y + self.BOX_HEADER_HEIGHT
+
+        for item in section_items:
+            height = self.item_height(item)
+
+            if y + height <= box_y + self.HEIGHT_BOX:
+                yield box_y, y, item, None
+                y += height
+                continue
+
+            if height <= self.HEIGHT_BOX - self.BOX_HEADER_HEIGHT:
+                box_y = next(boxes)
+                y = box_y + self.BOX_HEADER_HEIGHT
+                yield box_y, y, item, None
+                y += height
+                continue
+
+            head = self._head_height(item)
+            total = len(self.wrap_lines(self._message(item), self.WIDTH_BOX - self.X_MARGIN_BOX / 2))
+            first = 0
+
+            if y + head + self.LINE_HEIGHT > box_y + self.HEIGHT_BOX:
+                box_y = next(boxes)
+                y = box_y + self.BOX_HEADER_HEIGHT
+
+            while first < total:
+                top = head if first == 0 else 0
+                stop = min(total, first + int((box_y + self.HEIGHT_BOX - y - top) // self.LINE_HEIGHT))
+
+                yield box_y, y, item, (first, stop)
+                y += top + (stop - first) * self.LINE_HEIGHT
+                first = stop
+
+                if first < total:
+                    box_y = next(boxes)
+                    y = box_y + self.BOX_HEADER_HEIGHT
+
+            # The blank line after the message.
+            y += self.LINE_HEIGHT
+
+    def add_box(self, y_box, section_name):
+        if y_box == self.Y_MARGIN_TOP_BOX:
+            self.pdf.add_page()
+
+        # In the compact output everything but the section name is
+        # the same in every box at this position, and becomes a form.
+        compact = isinstance(self.pdf, CompactFPDF)
+        start = len(self.pdf.pages[self.pdf.page])
+        self.draw_box(y_box)
+        self.pdf = self.report_header.add_header(
+            x_margin_box=self.X_MARGIN_BOX, 
+            y_margin_box=y_box, 
+            width_box=self.WIDTH_BOX, 
+            client_data=self.client_data, 
+            section=None if compact else section_name
+        )
 
-        return message_height <= available_space
+        if compact:
+            self.pdf.draw_as_form(start)
+            self.report_header.add_section_name(self.X_MARGIN_BOX, y_box, section_name)
+
+    def add_content_to_pdf(self, item, lines=None):
+        """
+        Draw the item at the current position or, with lines, only
+        the (first, stop) range of its message lines from paginate.
+        """
+        if lines is not None and lines[0] > 0:
+            return self._add_message_lines(item, *lines)
 
-    def add_content_to_pdf(self, item):
         self.pdf.set_text_color(*self.WHITE)
 
         if 'mensagem' in item:
             if 'forte' in item['mensagem'].lower():
-                self.pdf.set_fill_color(*self.RED)
+                self._set_fill_color(self.RED)
             else:
-                self.pdf.set_fill_color(*self.GRAY)
+                self._set_fill_color(self.GRAY)
 
-        self.pdf.set_font('Arial', 'B', 9)
+        self._set_font('B', 9)
 
         if 'fenomeno' in item:
             self.pdf.cell(
@@ -184,10 +557,13 @@ class ReportPDF(Report):
         if 'data' in item:
             self.pdf.cell(10, 1, ln=True)
             self.pdf.cell(41, 4, f"{'/'.join(date)} às {hour}")
-            self.pdf.set_font('Arial', '', 9)
+            self._set_font('', 9)
             self.pdf.set_x(self.X_MARGIN_BOX)
 
         if 'mensagem' in item:
+            if lines is not None:
+                return self._add_message_lines(item, *lines)
+
             self.pdf.set_left_margin(self.X_MARGIN_BOX + 5)
             self.pdf.multi_cell(
                 w=self.WIDTH_BOX - self.X_MARGIN_BOX / 2, 
@@ -200,83 +576,100 @@ class ReportPDF(Report):
 
             return  self.pdf.get_y()
 
-    def generate_report_pdf(self, section_list):
+    def _add_message_lines(self, item, first, stop):
+        """Draw the message lines first to stop of an item split across boxes."""
+        width = self.WIDTH_BOX - self.X_MARGIN_BOX / 2
+        message = self._message(item)
+        spans = self.wrap_lines(message, width)
+
+        if first > 0:
+            self._set_font('', 9)
+            self.pdf.set_text_color(*self.BLACK)
+
+        self.pdf.set_left_margin(self.X_MARGIN_BOX + 5)
+        self.pdf.multi_cell(
+            w=width,
+            h=4,
+            txt=message.replace('\r', '')[spans[first][0]:spans[stop - 1][1]],
+            align='J'
+        )
+
+        if stop == len(spans):
+            self.pdf.cell(width, 4, ln=True)
 
+        return self.pdf.get_y()
+
+    def layout(self, section_list):
+        """
+        Draw every section of the report, without writing the file.
+        Each section starts on a new page and its items are drawn
+        in a single pass, following the positions from paginate.
+        """
         for section_dict in section_list:
 
             for section_name, section_items in section_dict.items():
-                current_y_position = self.Y_MARGIN_TOP_BOX + 30
-                self.pdf.add_page()
-                self.draw_box(self.Y_MARGIN_TOP_BOX)
-                self.draw_box(self.Y_MARGIN_BOTTOM_BOX)
-                
-                self.pdf = self.report_header.add_header(
-                    x_margin_box=self.X_MARGIN_BOX, 
-                    y_margin_box=self.Y_MARGIN_TOP_BOX, 
-                    width_box=self.WIDTH_BOX, 
-                    client_data=self.client_data, 
-                    section=section_name
-                )
-                self.pdf = self.report_header.add_header(
-                    x_margin_box=self.X_MARGIN_BOX, 
-                    y_margin_box=self.Y_MARGIN_BOTTOM_BOX, 
-                    width_box=self.WIDTH_BOX, 
-                    client_data=self.client_data, 
-                    section=section_name
-                )
-
-                y_margin_box = self.Y_MARGIN_TOP_BOX
-                items_quantity = len(section_items)
-                loop = 1
-
-                for item in section_items:
-                    message = item.get('mensagem', '')
-                    message_fit = self.can_fit_message(
-                        message, 
-                        current_y_position, 
-                        y_margin_box + 20, 
-                        self.HEIGHT_BOX, 
-                        self.WIDTH_BOX
-                    )
-
-                    if not message_fit:
-                        if not message_fit and current_y_position == 256:
-                            self.pdf.add_page()
-                            self.draw_box(self.Y_MARGIN_TOP_BOX)
-                            self.pdf = self.report_header.add_header(
-                                x_margin_box=self.X_MARGIN_BOX, 
-                                y_margin_box=self.Y_MARGIN_TOP_BOX, 
-                                width_box=self.WIDTH_BOX, 
-                                client_data=self.client_data, 
-                                section=section_name
-                            )
-
-                            if not loop == items_quantity:
-                                self.draw_box(self.Y_MARGIN_BOTTOM_BOX)
-                                self.pdf = self.report_header.add_header(
-                                    x_margin_box=self.X_MARGIN_BOX, 
-                                    y_margin_box=self.Y_MARGIN_BOTTOM_BOX, 
-                                    width_box=self.WIDTH_BOX, 
-                                    client_data=self.client_data, 
-                                    section=section_name
-                                )
-                            y_margin_box = self.Y_MARGIN_TOP_BOX
-                            current_y_position = self.Y_MARGIN_TOP_BOX + 30
-                            self.pdf.set_xy(self.X_MARGIN_BOX + 5, current_y_position)
-                            current_y_position = self.add_content_to_pdf(item)
-                        else:
-                            y_margin_box = self.Y_MARGIN_BOTTOM_BOX
-                            current_y_position = self.Y_MARGIN_BOTTOM_BOX + 30
-                            self.pdf.set_xy(self.X_MARGIN_BOX + 5, current_y_position)
-                            current_y_position = self.add_content_to_pdf(item)
-
-                    else:
-                        self.pdf.set_xy(self.X_MARGIN_BOX + 5, current_y_position)
-                        current_y_position = self.add_content_to_pdf(item)
-
-                    loop += 1
-
-        pdf_file = self._get_pdf_file_path()
-        self.pdf.output(pdf_file)
-
-        return pdf_file
+                with metrics.time(f'report.layout.{section_name}'):
+                    current_box = None
+
+                    for box_y, y, item, lines in self.paginate(section_items):
+                        if box_y != current_box:
+                            self.add_box(box_y, section_name)
+                            current_box = box_y
+
+                        self.pdf.set_xy(self.X_MARGIN_BOX + 5, y)
+                        self.add_content_to_pdf(item, lines)
+
+                    if current_box is None:
+                        self.add_box(self.Y_MARGIN_TOP_BOX, section_name)
+
+        return self.pdf
+
+    def generate_report_pdf(self, section_list, in_memory=False):
+        self.layout(section_list)
+        return output_report(self.pdf, self._get_pdf_file_path(), in_memory)
+
+
+class ReportTemplate:
+    """
+    Lays out the sections shared by every client only once, with
+    a placeholder in place of the client name, and stamps each
+    client's name on a copy of the cached page streams (or, in
+    the compact output, of the forms with the box headers).
+    """
+    CLIENT_NAME_PLACEHOLDER = '{nimbus_cliente}'
+
+    def __init__(self, section_list, context: RenderContext = None, compact=False) -> None:
+        pdf = CompactFPDF() if compact else FPDF()
+        self.context = context if context is not None else RenderContext()
+        report_pdf = ReportPDF(
+            {'name': self.CLIENT_NAME_PLACEHOLDER, 'phone_number': ''},
+            pdf,
+            ReportHeader(pdf, self.context)
+        )
+        self.pdf = report_pdf.layout(section_list)
+        if compact:
+            # Decided once, with the placeholder, for every client.
+            self.pdf.inline_forms()
+        self.placeholder = self._text_operand(self.CLIENT_NAME_PLACEHOLDER)
+
+    def _text_operand(self, client_name):
+        # Same text that ReportClientName writes into the page stream.
+        return f'({self.pdf._escape(client_name.capitalize())})'
+
+    def render(self, client_data, in_memory=False):
+        client_name = self._text_operand(client_data['name'])
+        pdf = copy.copy(self.pdf)
+        pdf.pages = {
+            number: page.replace(self.placeholder, client_name)
+            for number, page in self.pdf.pages.items()
+        }
+        if isinstance(pdf, CompactFPDF):
+            pdf.forms = {
+                operators.replace(self.placeholder, client_name): number
+                for operators, number in self.pdf.forms.items()
+            }
+        pdf.offsets = {}
+        pdf.fonts = {key: dict(font) for key, font in self.pdf.fonts.items()}
+
+        pdf_file = ReportPDF(client_data, pdf, None, self.context)._get_pdf_file_path()
+        return output_report(pdf, pdf_file, in_memory)
@@ -0,0 +1,115 @@
+import os
+import json
+import hashlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from services.report_storage import write_atomic
+
+
+class ReportManifest:
+    """
+    Manifest of the reports already generated, by phone number,
+    with a hash of everything the report depends on: the client
+    data, the section items, the dates and the template version.
+    A report is reused while its hash and its file are unchanged.
+    Runs that overlap each merge their own entries into the
+    manifest on disk when they save.
+    """
+
+    def __init__(self, path='reports/manifest.json'):
+        self.path = path
+        self.entries = self._load()
+        # Entries updated by this run, merged into the manifest on save.
+        self.updated = {}
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return {}
+
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    @contextmanager
+    def _lock(self):
+        """Exclusive lock between the runs that save the manifest."""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(f'{self.path}.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def sections_digest(section_list, *values):
+        """Hash of the sections shared by every client, plus any extra values."""
+        digest = hashlib.sha256()
+
+        for value in values:
+            digest.update(f'{value}\0'.encode('utf-8'))
+
+        for section_dict in section_list:
+            for section_name, section_items in section_dict.items():
+                digest.update(f'{section_name}\0'.encode('utf-8'))
+                for item in section_items:
+                    digest.update(json.dumps(item, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+                    digest.update(b'\n')
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def report_digest(client, sections_digest):
+        client_data = json.dumps(client, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f'{sections_digest}\0{client_data}'.encode('utf-8')).hexdigest()
+
+    def get(self, phone_number, digest):
+        """Path of the current report for the phone number, or None if it must be rendered."""
+        entry = self.entries.get(phone_number)
+
+        if entry is None or entry['digest'] != digest:
+            return None
+
+        try:
+            stat = os.stat(entry['path'])
+        except OSError:
+            return None
+
+        if stat.st_size != entry['size'] or stat.st_mtime_ns != entry['mtime_ns']:
+            return None
+
+        return entry['path']
+
+    def update(self, phone_number, digest, path):
+        stat = os.stat(path)
+        self.entries[phone_number] = self.updated[phone_number] = {
+            'digest': digest,
+            'path': path,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        }
+
+    def save(self):
+        """
+        Merge the entries updated by this run into the manifest on
+        disk, as it is now, so concurrent runs keep each other's.
+        """
+        if not self.updated:
+            return
+
+        with self._lock():
+            entries = self._load()
+            entries.update(self.updated)
+            write_atomic(self.path, json.dumps(entries).encode('utf-8'))
+
+        self.entries = entries
+        self.updated = {}
@@ -0,0 +1,43 @@
+import os
+
+from services.metrics import metrics
+from services.report_storage import write_atomic
+
+
+# Bump whenever the layout changes, so the reports cached by
+# ReportManifest are rendered again.
+TEMPLATE_VERSION = 2
+
+
+class ReportBuffer:
+    """PDF report kept in memory instead of written to its path in the reports/ directory."""
+
+    def __init__(self, path, content) -> None:
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.content = content
+
+    def __len__(self):
+        return len(self.content)
+
+    def __str__(self):
+        return f'{self.filename} (em memória, {len(self)} bytes)'
+
+    def spill(self) -> str:
+        """Write the report to its path, returning it."""
+        return write_atomic(self.path, self.content)
+
+
+def output_report(pdf, pdf_file, in_memory=False):
+    """
+    Write the PDF to pdf_file, atomically, and return its path
+    or, in memory mode, return it as a ReportBuffer for that path.
+    """
+    with metrics.time('report.output'):
+        # fpdf keeps the document as a latin-1 string.
+        content = pdf.output(dest='S').encode('latin-1')
+
+        if in_memory:
+            return ReportBuffer(pdf_file, content)
+
+        return write_atomic(pdf_file, content)
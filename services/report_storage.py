@@ -0,0 +1,237 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import secrets
+import zipfile
+import tempfile
+from datetime import date, datetime, timedelta
+
+
+REPORT_PREFIX = 'relatorio_meteorologico'
+REPORT_NAME_PATTERN = re.compile(rf'^{REPORT_PREFIX}_(?P<phone>[^_]+)_(?P<date>\d{{8}})_(?P<run>[^_.]+)\.pdf$')
+SHARDS = 256
+
+
+def _umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Read once, since changing the umask to read it isn't thread-safe.
+FILE_MODE = 0o666 & ~_umask()
+
+
+def new_run_id() -> str:
+    """Identifier of a run, part of the name of every report it writes."""
+    return f'{datetime.now():%H%M%S}{secrets.token_hex(2)}'
+
+
+def write_atomic(path, content):
+    """
+    Write content to a temporary file in the directory of path and
+    rename it over path, so no reader ever sees a partial report.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=directory)
+
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            # mkstemp creates the file readable by its owner only.
+            os.chmod(temp_path, FILE_MODE)
+            file.write(content)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+    return path
+
+
+class ReportStorage:
+    """
+    Layout of the reports directory: one directory per creation
+    day (root/YYYY/MM/DD), split in SHARDS directories by a hash of
+    the phone number, and the run id in every file name, so runs
+    on the same day never overwrite each other's reports.
+    """
+
+    def __init__(self, root='reports', run_id=None) -> None:
+        self.root = root
+        self.run_id = run_id or new_run_id()
+
+    @staticmethod
+    def shard(phone_number) -> str:
+        digest = hashlib.md5(phone_number.encode('utf-8')).digest()
+        return f'{int.from_bytes(digest[:2], "big") % SHARDS:02x}'
+
+    def day_dir(self, day) -> str:
+        return os.path.join(self.root, f'{day:%Y}', f'{day:%m}', f'{day:%d}')
+
+    def report_path(self, phone_number, creation_date) -> str:
+        """Path of the report of the phone number created on creation_date (dd/mm/YYYY)."""
+        day = datetime.strptime(creation_date, '%d/%m/%Y').date()
+        name = f'{REPORT_PREFIX}_{phone_number}_{day:%d%m%Y}_{self.run_id}.pdf'
+        return os.path.join(self.day_dir(day), self.shard(phone_number), name)
+
+    def days(self):
+        """Yield (day, directory) of every day directory, oldest first."""
+        for year in sorted(self._numbered(self.root, 4)):
+            for month in sorted(self._numbered(os.path.join(self.root, year), 2)):
+                for day in sorted(self._numbered(os.path.join(self.root, year, month), 2)):
+                    try:
+                        yield date(int(year), int(month), int(day)), os.path.join(self.root, year, month, day)
+                    except ValueError:
+                        continue
+
+    @staticmethod
+    def _numbered(directory, digits):
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            return []
+        return [name for name in names if len(name) == digits and name.isdigit()]
+
+
+class ReportArchive:
+    """
+    Bundles of past days: the reports of a day directory packed in
+    archive/YYYY-MM-DD.zip, with a YYYY-MM-DD.index.json beside it
+    that maps each phone number to its entries, so one report is
+    read straight from the bundle without unpacking the others.
+    """
+
+    def __init__(self, storage: ReportStorage = None, directory=None) -> None:
+        self.storage = storage if storage is not None else ReportStorage()
+        self.directory = directory or os.path.join(self.storage.root, 'archive')
+
+    def bundle_path(self, day) -> str:
+        return os.path.join(self.directory, f'{day:%Y-%m-%d}.zip')
+
+    def index_path(self, day) -> str:
+        return os.path.join(self.directory, f'{day:%Y-%m-%d}.index.json')
+
+    def archive(self, keep_days=7, today=None):
+        """
+        Archive every day older than the last keep_days days,
+        returning (day, number of reports archived) for each one.
+        """
+        today = today or date.today()
+        cutoff = today - timedelta(days=keep_days)
+
+        return [
+            (day, self.archive_day(day, directory))
+            for day, directory in list(self.storage.days())
+            if day < cutoff
+        ]
+
+    def archive_day(self, day, directory) -> int:
+        """
+        Pack the reports of the day directory into its bundle, then
+        remove them. Reports already in the bundle are kept, so a
+        day can be archived again when late reports show up.
+        """
+        reports = sorted(
+            (name, os.path.join(root, name))
+            for root, _, names in os.walk(directory)
+            for name in names
+            if REPORT_NAME_PATTERN.match(name)
+        )
+        if not reports:
+            self._remove_empty_dirs(directory)
+            return 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        bundle_path = self.bundle_path(day)
+        fd, temp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=self.directory)
+        os.close(fd)
+
+        try:
+            os.chmod(temp_path, FILE_MODE)
+            with zipfile.ZipFile(temp_path, 'w', compression=zipfile.ZIP_DEFLATED) as bundle:
+                names = {name for name, _ in reports}
+
+                if os.path.isfile(bundle_path):
+                    with zipfile.ZipFile(bundle_path) as previous:
+                        for info in previous.infolist():
+                            if info.filename not in names:
+                                with previous.open(info) as source, bundle.open(info, 'w') as target:
+                                    shutil.copyfileobj(source, target)
+
+                for name, path in reports:
+                    bundle.write(path, arcname=name)
+
+                index = self._index(bundle, os.path.basename(bundle_path))
+
+            os.replace(temp_path, bundle_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        write_atomic(self.index_path(day), json.dumps(index, indent=2, ensure_ascii=False).encode('utf-8'))
+
+        for _, path in reports:
+            os.remove(path)
+        self._remove_empty_dirs(directory)
+
+        return len(reports)
+
+    @staticmethod
+    def _index(bundle, bundle_name):
+        reports = {}
+
+        for info in bundle.infolist():
+            match = REPORT_NAME_PATTERN.match(info.filename)
+            if match is None:
+                continue
+            reports.setdefault(match['phone'], []).append({
+                'name': info.filename,
+                'run': match['run'],
+                'size': info.file_size,
+            })
+
+        # Run ids start with the time of the run.
+        for entries in reports.values():
+            entries.sort(key=lambda entry: entry['run'])
+
+        return {'bundle': bundle_name, 'reports': reports}
+
+    @staticmethod
+    def _remove_empty_dirs(directory):
+        for root, _, _ in sorted(os.walk(directory), key=lambda entry: len(entry[0]), reverse=True):
+            try:
+                os.rmdir(root)
+            except OSError:
+                pass
+
+    def find(self, phone_number, day):
+        """Index entries of the archived reports of the phone number on day, oldest first."""
+        try:
+            with open(self.index_path(day), 'r') as file:
+                index = json.load(file)
+        except FileNotFoundError:
+            return []
+
+        return index['reports'].get(phone_number, [])
+
+    def read(self, phone_number, day, run_id=None):
+        """
+        (name, content) of the archived report of the phone number on
+        day, from run_id or the latest run, or None when there's none.
+        """
+        entries = [
+            entry for entry in self.find(phone_number, day)
+            if run_id is None or entry['run'] == run_id
+        ]
+        if not entries:
+            return None
+
+        name = entries[-1]['name']
+        with zipfile.ZipFile(self.bundle_path(day)) as bundle:
+            return name, bundle.read(name)
@@ -0,0 +1,132 @@
+import os
+import glob
+import time
+import logging
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def segments_dir(data_path='data_received.txt'):
+    return f'{data_path}.segments'
+
+
+def segment_path(worker, data_path='data_received.txt'):
+    """Data file segment written by one worker process of the server."""
+    return os.path.join(segments_dir(data_path), f'{worker}.txt')
+
+
+@contextmanager
+def merge_lock(data_path):
+    """Exclusive lock between the processes that merge segments into data_path."""
+    with open(f'{data_path}.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _read_offset(segment):
+    try:
+        with open(f'{segment}.offset', 'r') as file:
+            return int(file.read() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _write_offset(segment, offset):
+    temp_path = f'{segment}.offset.tmp'
+    with open(temp_path, 'w') as file:
+        file.write(str(offset))
+    os.replace(temp_path, f'{segment}.offset')
+
+
+def stamp_lines(lines, stamp=None):
+    """
+    Prefix each line written to a segment with the time it was
+    committed (monotonic, in nanoseconds), which orders the lines
+    of all the workers when the segments are merged.
+    """
+    prefix = b'%d ' % (time.monotonic_ns() if stamp is None else stamp)
+    return [prefix + line for line in lines]
+
+
+def _unstamp(line):
+    stamp, separator, record = line.partition(b' ')
+    if separator and stamp.isdigit():
+        return int(stamp), record
+    return 0, line
+
+
+def merge_segments(data_path='data_received.txt', client_store=None, remove=False):
+    """
+    Append the complete lines written to the worker segments since
+    the last merge to the data file, indexing them in client_store
+    when one is given, and return how many lines were merged. The
+    lines of all the segments are merged in the order they were
+    committed, so duplicates of the same phone number sent to
+    different workers resolve to the latest one. With remove, the
+    merged segments are deleted, which is only safe while no worker
+    is writing.
+    """
+    directory = segments_dir(data_path)
+
+    if not os.path.isdir(directory):
+        return 0
+
+    with merge_lock(data_path):
+        segments = sorted(
+            (int(os.path.splitext(os.path.basename(path))[0]), path)
+            for path in glob.glob(os.path.join(directory, '*.txt'))
+        )
+        pending = []
+        merged_offsets = []
+
+        for worker, segment in segments:
+            offset = _read_offset(segment)
+
+            with open(segment, 'rb') as file:
+                file.seek(offset)
+                data = file.read()
+
+            end = data.rfind(b'\n') + 1
+
+            for position, line in enumerate(data[:end - 1].split(b'\n') if end else []):
+                stamp, record = _unstamp(line)
+                pending.append((stamp, worker, position, record + b'\n'))
+
+            merged_offsets.append((segment, offset, end, data[end:]))
+
+        pending.sort()
+        lines = [record for _, _, _, record in pending]
+
+        if lines:
+            with open(data_path, 'ab') as data_file:
+                start_offset = data_file.tell()
+                data_file.write(b''.join(lines))
+                data_file.flush()
+                os.fsync(data_file.fileno())
+
+        # A crash before the offsets are written only merges the lines again.
+        for segment, offset, end, _ in merged_offsets:
+            if end:
+                _write_offset(segment, offset + end)
+
+        if lines and client_store is not None:
+            client_store.append(lines, start_offset)
+
+        if remove:
+            for segment, _, _, incomplete in merged_offsets:
+                if incomplete:
+                    logging.warning(f'Linha incompleta descartada do segmento {segment}: {incomplete!r}')
+                os.remove(segment)
+                if os.path.exists(f'{segment}.offset'):
+                    os.remove(f'{segment}.offset')
+
+    return len(lines)
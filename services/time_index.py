@@ -0,0 +1,113 @@
+import logging
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M'
+
+
+def parse_timestamp(item):
+    """Timestamp of the item's `data`, or None (logged) when it's invalid."""
+    try:
+        return datetime.strptime(item['data'], DATE_FORMAT)
+    except (KeyError, TypeError, ValueError):
+        logging.warning(f'Item ignorado por data inválida: {item!r}')
+        return None
+
+
+class TimeIndex:
+    """
+    Items of a section sorted once by their `data` timestamp,
+    so any time window can be picked by binary search.
+    """
+
+    def __init__(self, items):
+        entries = []
+
+        for item in items:
+            timestamp = parse_timestamp(item)
+            if timestamp is not None:
+                entries.append((timestamp, len(entries), item))
+
+        entries.sort()
+        self.timestamps = [timestamp for timestamp, _, _ in entries]
+        self.items = [item for _, _, item in entries]
+
+    def __len__(self):
+        return len(self.items)
+
+    def window(self, start=None, end=None):
+        """Items between start and end (both inclusive), in chronological order."""
+        low = 0 if start is None else bisect_left(self.timestamps, start)
+        high = len(self.timestamps) if end is None else bisect_right(self.timestamps, end)
+        return self.items[low:high]
+
+
+def get_window(date, lookback=None, lookahead=None):
+    """
+    Bounds of the window around date, with lookback and
+    lookahead in hours. A missing value leaves that side open.
+    """
+    start = date - timedelta(hours=lookback) if lookback is not None else None
+    end = date + timedelta(hours=lookahead) if lookahead is not None else None
+    return start, end
+
+
+class WindowItems:
+    """
+    Re-iterable view of the items of a streamed section inside a
+    time window. Every iteration streams the section again and
+    only holds the items in the window, to sort them.
+    """
+
+    def __init__(self, items, start=None, end=None):
+        self.items = items
+        self.start = start
+        self.end = end
+
+    def __iter__(self):
+        entries = []
+
+        for item in self.items:
+            timestamp = parse_timestamp(item)
+            if timestamp is None:
+                continue
+            if (self.start is None or timestamp >= self.start) and (self.end is None or timestamp <= self.end):
+                entries.append((timestamp, len(entries), item))
+
+        entries.sort()
+        for _, _, item in entries:
+            yield item
+
+
+def index_sections(section_list):
+    """TimeIndex of the items of each section."""
+    return [
+        {name: TimeIndex(items) for name, items in section_dict.items()}
+        for section_dict in section_list
+    ]
+
+
+def window_indexes(indexes, date, lookback=None, lookahead=None):
+    """Items of each section of index_sections inside the window around date."""
+    start, end = get_window(date, lookback, lookahead)
+    return [
+        {name: index.window(start, end) for name, index in index_dict.items()}
+        for index_dict in indexes
+    ]
+
+
+def window_sections(section_list, date, lookback=None, lookahead=None):
+    """
+    Keep only the items of each section inside the window around
+    date. Sections streamed from the file are filtered as they are
+    read, instead of being loaded into a TimeIndex.
+    """
+    start, end = get_window(date, lookback, lookahead)
+    return [
+        {
+            name: TimeIndex(items).window(start, end) if isinstance(items, list) else WindowItems(items, start, end)
+            for name, items in section_dict.items()
+        }
+        for section_dict in section_list
+    ]
@@ -0,0 +1,67 @@
+import re
+
+
+EMAIL_REGEX = r'[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+'
+PHONE_NUMBER_REGEX = r'\d{11}|\d{12}'
+
+EMAIL_PATTERN = re.compile(EMAIL_REGEX)
+PHONE_NUMBER_PATTERN = re.compile(PHONE_NUMBER_REGEX)
+# The whole `name,email,phone,age` record in a single match, for the common valid case.
+RECORD_PATTERN = re.compile(rf'([^,]*),(?:{EMAIL_REGEX}),(?:{PHONE_NUMBER_REGEX}),([^,]*)')
+
+INVALID_FIELD_COUNT = 'número de campos inválido'
+INVALID_EMAIL = 'e-mail inválido'
+INVALID_PHONE_NUMBER = 'telefone inválido'
+INVALID_AGE = 'idade inválida'
+INVALID_NAME = 'nome inválido'
+
+
+def invalid_reason(data):
+    """Check the fields one by one, returning why the record is invalid, or None."""
+    fields = data.strip().split(',')
+
+    if len(fields) != 4:
+        return INVALID_FIELD_COUNT
+
+    name, email, phone_number, age = fields
+
+    if not EMAIL_PATTERN.fullmatch(email):
+        return INVALID_EMAIL
+
+    if not PHONE_NUMBER_PATTERN.fullmatch(phone_number):
+        return INVALID_PHONE_NUMBER
+
+    if not age.isdigit():
+        return INVALID_AGE
+
+    if name.isdigit():
+        return INVALID_NAME
+
+    return None
+
+
+def validate_records(records):
+    """
+    Validate many `name,email,phone,age` records in one call,
+    returning for each one None when it is valid or the reason
+    why it was rejected.
+    """
+    fullmatch = RECORD_PATTERN.fullmatch
+    reasons = []
+
+    for data in records:
+        match = fullmatch(data.strip())
+
+        if match is not None:
+            name, age = match.groups()
+            if age.isdigit() and not name.isdigit():
+                reasons.append(None)
+                continue
+
+        reasons.append(invalid_reason(data))
+
+    return reasons
+
+
+def validate_record(data):
+    return validate_records((data,))[0]
@@ -0,0 +1,128 @@
+import os
+import asyncio
+import logging
+import sqlite3
+
+from services.metrics import metrics
+from services.segments import stamp_lines
+
+
+FSYNC_POLICIES = ('always', 'data', 'never')
+
+
+class BatchWriter:
+    """
+    Keeps the data file open and coalesces the records
+    submitted by many connections into batched writes.
+    Each batch is flushed (and fsynced, according to the
+    policy) and indexed in the client store, when one is
+    given, before the futures of its records are resolved.
+    At most max_queue_size records wait to be written (zero
+    means no limit). With stamp, each line is prefixed with its
+    commit time, as in the segments of the server workers.
+    """
+
+    def __init__(self, filepath='data_received.txt', commit_interval=0.002, max_batch_size=4096, fsync='always', client_store=None, max_queue_size=0, stamp=False):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'Política de fsync inválida: {fsync}')
+
+        self.filepath = filepath
+        self.commit_interval = commit_interval
+        self.max_batch_size = max_batch_size
+        self.fsync = fsync
+        self.client_store = client_store
+        self.max_queue_size = max_queue_size
+        self.stamp = stamp
+        self.file = None
+        self.queue = None
+        self.task = None
+
+    async def start(self):
+        self.file = open(self.filepath, 'ab')
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is None:
+            return
+
+        await self.queue.put((None, None))
+        await self.task
+        self.file.close()
+        self.task = None
+
+        if self.client_store is not None:
+            self.client_store.close()
+
+    def submit(self, record):
+        """
+        Queue a record line to be written and return a future
+        that resolves once the batch containing it is durable.
+        Raises asyncio.QueueFull when the writer is behind and
+        max_queue_size records are already waiting.
+        """
+        loop = asyncio.get_running_loop()
+        saved = loop.create_future()
+        submitted_at = loop.time()
+        self.queue.put_nowait((record, saved))
+        saved.add_done_callback(lambda _: metrics.observe('server.save', loop.time() - submitted_at))
+        return saved
+
+    async def write(self, record):
+        await self.submit(record)
+
+    def _commit(self, records):
+        with metrics.time('server.commit'):
+            self._write_batch(records)
+        metrics.incr('server.commits')
+        metrics.incr('server.commit.records', len(records))
+
+    def _write_batch(self, records):
+        lines = [record.encode('utf-8') for record in records]
+        self.file.write(b''.join(stamp_lines(lines) if self.stamp else lines))
+        self.file.flush()
+
+        if self.fsync == 'always':
+            os.fsync(self.file.fileno())
+        elif self.fsync == 'data':
+            getattr(os, 'fdatasync', os.fsync)(self.file.fileno())
+
+        if self.client_store is not None:
+            end_offset = self.file.tell()
+            try:
+                self.client_store.append(lines, end_offset - sum(len(line) for line in lines))
+            except sqlite3.Error as e:
+                # The data file is the source of truth, the index catches up on the next commit.
+                logging.error(f'Erro ao atualizar o índice de clientes: {e}')
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        running = True
+
+        while running:
+            record, saved = await self.queue.get()
+            if saved is None:
+                break
+
+            if self.commit_interval:
+                await asyncio.sleep(self.commit_interval)
+
+            batch = [(record, saved)]
+            while len(batch) < self.max_batch_size and not self.queue.empty():
+                record, saved = self.queue.get_nowait()
+                if saved is None:
+                    running = False
+                    break
+                batch.append((record, saved))
+
+            try:
+                await loop.run_in_executor(None, self._commit, [record for record, _ in batch])
+            except OSError as e:
+                for _, saved in batch:
+                    if not saved.done():
+                        saved.set_exception(e)
+                continue
+
+            for _, saved in batch:
+                if not saved.done():
+                    saved.set_result(None)